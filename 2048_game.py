@@ -2,6 +2,7 @@
 Clone of 2048 game.
 """
 import random
+import time
 import poc_2048_gui
 
 # Directions
@@ -50,9 +51,16 @@ class TwentyFortyEight:
     Class to run the game logic.
     """
 
-    def __init__(self, grid_height, grid_width):        
+    def __init__(self, grid_height, grid_width, seed=None, log=None):        
         self._grid_height = grid_height
         self._grid_width = grid_width
+        # without a seed, tiles come from the random module as before,
+        # so random.seed() still reproduces a game
+        if seed is None:
+            self._rng = random
+        else:
+            self._rng = random.Random(seed)
+        self._log = log
         indices_directions = {}
         
         up_ind = []
@@ -82,8 +90,66 @@ class TwentyFortyEight:
         """
         self._cells = [[0 for dummy_col in range(self._grid_width)]
                            for dummy_row in range(self._grid_height)]
-        self.new_tile()
-        self.new_tile()
+        self._rebuild_index()
+        if self._log is not None:
+            self._log.clear()
+        for dummy_idx in range(2):
+            spawn = self.new_tile()
+            if self._log is not None:
+                self._log.record(None, spawn[0], spawn[1], spawn[2])
+
+    def _rebuild_index(self):
+        """
+        Recomputes the empty cell index and the count of equal
+        neighbouring tiles from scratch.
+        """
+        self._empty_cells = []
+        self._empty_positions = {}
+        self._equal_pairs = 0
+        for row in range(self._grid_height):
+            for col in range(self._grid_width):
+                value = self._cells[row][col]
+                if value == 0:
+                    self._empty_positions[(row, col)] = len(self._empty_cells)
+                    self._empty_cells.append((row, col))
+                else:
+                    if col + 1 < self._grid_width and self._cells[row][col + 1] == value:
+                        self._equal_pairs += 1
+                    if row + 1 < self._grid_height and self._cells[row + 1][col] == value:
+                        self._equal_pairs += 1
+
+    def _equal_neighbours(self, row, col, value):
+        """
+        Counts the neighbours of row, col holding the (non-zero) value.
+        """
+        if value == 0:
+            return 0
+        count = 0
+        if row > 0 and self._cells[row - 1][col] == value:
+            count += 1
+        if row + 1 < self._grid_height and self._cells[row + 1][col] == value:
+            count += 1
+        if col > 0 and self._cells[row][col - 1] == value:
+            count += 1
+        if col + 1 < self._grid_width and self._cells[row][col + 1] == value:
+            count += 1
+        return count
+
+    def get_empty_count(self):
+        """
+        Returns the number of empty cells.
+        """
+        return len(self._empty_cells)
+
+    def can_move(self):
+        """
+        Returns True if some move would change the board, that is
+        if there are two equal neighbouring tiles or both tiles and
+        empty cells (some tile then borders an empty cell).
+        """
+        num_empty = len(self._empty_cells)
+        return (self._equal_pairs > 0 or
+                0 < num_empty < self._grid_height * self._grid_width)
 
         
     def __str__(self):
@@ -135,32 +201,49 @@ class TwentyFortyEight:
                     self.set_tile(one_ind[nim][0], one_ind[nim][1],new_values[nim])
                     changes += 1
         if changes > 0:
-            self.new_tile()    
+            spawn = self.new_tile()
+            if self._log is not None:
+                self._log.record(direction, spawn[0], spawn[1], spawn[2])
                        
     def new_tile(self):
         """
         Creates a new tile in a randomly selected empty
         square.  The tile should be 2 90% of the time and
         4 10% of the time.
+
+        Returns the new tile as a tuple (row, col, value).
         """
-        empty_cells = []
-        for row in range(self._grid_height):
-            for cell in range (self._grid_width):
-                if self._cells[row][cell] == 0:
-                    empty_cells.append((row,cell))
-        chosen = random.choice(empty_cells)
-        prob = random.randint(1, 10)
+        chosen = self._rng.choice(self._empty_cells)
+        prob = self._rng.randint(1, 10)
         if prob <= 9:
-            self._cells[chosen[0]][chosen[1]]= 2
+            value = 2
         else:
-            self._cells[chosen[0]][chosen[1]] = 4
+            value = 4
+        self.set_tile(chosen[0], chosen[1], value)
+        return (chosen[0], chosen[1], value)
         
 
     def set_tile(self, row, col, value):
         """
         Sets the tile at position row, col to have the given value.
+        Keeps the empty cell index and equal pair count up to date.
         """
+        old_value = self._cells[row][col]
+        if old_value == value:
+            return
+        self._equal_pairs -= self._equal_neighbours(row, col, old_value)
         self._cells[row][col] = value
+        self._equal_pairs += self._equal_neighbours(row, col, value)
+        if old_value == 0:
+            # swap the cell with the last empty cell and drop it
+            position = self._empty_positions.pop((row, col))
+            last_cell = self._empty_cells.pop()
+            if last_cell != (row, col):
+                self._empty_cells[position] = last_cell
+                self._empty_positions[last_cell] = position
+        elif value == 0:
+            self._empty_positions[(row, col)] = len(self._empty_cells)
+            self._empty_cells.append((row, col))
 
         
     def get_tile(self, row, col):
@@ -170,6 +253,1033 @@ class TwentyFortyEight:
         return self._cells[row][col]
 
 
+# Bitboard version of the game. Each tile is stored as a 4-bit log2 code
+# (0 for empty, 1 for 2, ..., 15 for 32768) packed into a single integer,
+# cell (row, col) at bit offset 4 * (row * width + col).
+
+TILE_BITS = 4
+TILE_MASK = 15
+TILE_VALUES = [0] + [2 ** code for code in range(1, 16)]
+TILE_CODES = dict([(value, code) for code, value in enumerate(TILE_VALUES)])
+
+# Lines up to this length get their full transition table built up front,
+# longer lines are added to the table the first time they are seen.
+EAGER_LINE_LENGTH = 4
+
+# (line length, reversed) -> {line code: line code after the move}
+_LINE_TABLES = {}
+
+# (line length, reversed, stride) -> same table with the tiles of each
+# line spread stride cells apart, so a column of a board can be looked
+# up where it stands
+_COLUMN_TABLES = {}
+
+def decode_line(code, length):
+    """
+    Converts a packed line code into a list of tile values.
+    """
+    values = []
+    for dummy_idx in range(length):
+        values.append(TILE_VALUES[code & TILE_MASK])
+        code >>= TILE_BITS
+    return values
+
+def encode_line(values):
+    """
+    Converts a list of tile values into a packed line code.
+    Tiles above 32768 saturate at 32768.
+    """
+    code = 0
+    for index in range(len(values)):
+        tile_code = TILE_CODES.get(values[index], TILE_MASK)
+        code |= tile_code << (TILE_BITS * index)
+    return code
+
+def merge_code(code, length, reverse):
+    """
+    Merges a packed line with the same semantics as merge().
+    If reverse is True the line is merged towards its last tile.
+    """
+    values = decode_line(code, length)
+    if reverse:
+        values.reverse()
+    new_values = merge(values)
+    if reverse:
+        new_values.reverse()
+    return encode_line(new_values)
+
+def spread_line(code, length, stride):
+    """
+    Moves the tiles of a packed line stride cells apart.
+    """
+    spread = 0
+    for index in range(length):
+        tile_code = (code >> (TILE_BITS * index)) & TILE_MASK
+        spread |= tile_code << (TILE_BITS * stride * index)
+    return spread
+
+def compact_line(spread, length, stride):
+    """
+    Packs a line whose tiles are stride cells apart.
+    """
+    code = 0
+    for index in range(length):
+        tile_code = (spread >> (TILE_BITS * stride * index)) & TILE_MASK
+        code |= tile_code << (TILE_BITS * index)
+    return code
+
+def line_table(length, reverse):
+    """
+    Returns the transition table for lines of the given length.
+    """
+    key = (length, reverse)
+    if key not in _LINE_TABLES:
+        table = {}
+        if length <= EAGER_LINE_LENGTH:
+            for code in range(16 ** length):
+                table[code] = merge_code(code, length, reverse)
+        _LINE_TABLES[key] = table
+    return _LINE_TABLES[key]
+
+def column_table(length, reverse, stride):
+    """
+    Returns the transition table for lines of the given length
+    whose tiles are stride cells apart.
+    """
+    key = (length, reverse, stride)
+    if key not in _COLUMN_TABLES:
+        table = {}
+        for code, new_code in line_table(length, reverse).items():
+            table[spread_line(code, length, stride)] = spread_line(new_code, length, stride)
+        _COLUMN_TABLES[key] = table
+    return _COLUMN_TABLES[key]
+
+def move_line(table, code, length, reverse, stride=1):
+    """
+    Looks up the result of moving a packed line (tiles stride cells
+    apart), filling in the table if this line has not been seen before.
+    """
+    new_code = table.get(code)
+    if new_code is None:
+        new_code = merge_code(compact_line(code, length, stride), length, reverse)
+        new_code = spread_line(new_code, length, stride)
+        table[code] = new_code
+    return new_code
+
+def empty_cells(board, num_cells):
+    """
+    Returns a mask of the empty cells of a packed board, with the
+    lowest bit of each empty cell's 4 bits set.
+    """
+    occupied = board | (board >> 1)
+    occupied |= occupied >> 2
+    return ~occupied & int("1" * num_cells, 16)
+
+def random_empty_shift(empty, rng=random):
+    """
+    Returns the bit offset of a random cell of a non-zero
+    empty_cells() mask, drawn with rng.
+    """
+    for dummy_idx in range(rng.randrange(bin(empty).count("1"))):
+        empty &= empty - 1
+    return (empty & -empty).bit_length() - 1
+
+
+# (line length, reversed) -> {line code: points scored by the move}
+_SCORE_TABLES = {}
+
+def line_score(code, length, reverse):
+    """
+    Returns the sum of the tiles created by merging a packed line,
+    pairing tiles the same way as merge().
+    """
+    table = _SCORE_TABLES.setdefault((length, reverse), {})
+    if code in table:
+        return table[code]
+    values = decode_line(code, length)
+    if reverse:
+        values.reverse()
+    result = slide(values)
+    score = 0
+    for num in range(0, len(result) - 1):
+        if result[num] != 0 and result[num] == result[num + 1]:
+            score += result[num] * 2
+            result[num + 1] = 0
+    table[code] = score
+    return score
+
+
+class BitboardTwentyFortyEight:
+    """
+    Game logic on a packed board, same interface as TwentyFortyEight.
+    Tiles are limited to 32768, two merged 32768 tiles stay 32768.
+    """
+
+    def __init__(self, grid_height, grid_width, seed=None):
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        if seed is None:
+            self._rng = random
+        else:
+            self._rng = random.Random(seed)
+        self._row_bits = TILE_BITS * grid_width
+        self._row_mask = (1 << self._row_bits) - 1
+        self._row_tables = (line_table(grid_width, False),
+                            line_table(grid_width, True))
+        self._col_tables = (column_table(grid_height, False, grid_width),
+                            column_table(grid_height, True, grid_width))
+        self._col_mask = spread_line(int("f" * grid_height, 16), grid_height, grid_width)
+        self._empty_ones = int("1" * (grid_height * grid_width), 16)
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the game so the grid is empty except for two
+        initial tiles.
+        """
+        self._board = 0
+        self.new_tile()
+        self.new_tile()
+
+    def __str__(self):
+        """
+        Returns a string representation of the grid for debugging.
+        """
+        cells = [[self.get_tile(row, col) for col in range(self._grid_width)]
+                 for row in range(self._grid_height)]
+        return "The board is" + str(cells)
+
+    def get_grid_height(self):
+        """
+        Gets the height of the board.
+        """
+        return self._grid_height
+
+    def get_grid_width(self):
+        """
+        Gets the width of the board.
+        """
+        return self._grid_width
+
+    def get_board(self):
+        """
+        Returns the packed board.
+        """
+        return self._board
+
+    def set_board(self, board):
+        """
+        Replaces the packed board without adding a new tile.
+        """
+        self._board = board
+
+    def get_column(self, board, col):
+        """
+        Returns column col of a packed board as a packed line,
+        top tile first.
+        """
+        return compact_line((board >> (TILE_BITS * col)) & self._col_mask,
+                            self._grid_height, self._grid_width)
+
+    def moved_board(self, board, direction):
+        """
+        Returns the packed board after moving all tiles of board
+        in the given direction, without adding a new tile.
+        """
+        new_board = 0
+        if direction == LEFT or direction == RIGHT:
+            reverse = direction == RIGHT
+            table = self._row_tables[reverse]
+            row_mask = self._row_mask
+            for shift in range(0, self._grid_height * self._row_bits, self._row_bits):
+                code = (board >> shift) & row_mask
+                new_code = table.get(code)
+                if new_code is None:
+                    new_code = move_line(table, code, self._grid_width, reverse)
+                new_board |= new_code << shift
+        else:
+            reverse = direction == DOWN
+            table = self._col_tables[reverse]
+            col_mask = self._col_mask
+            for shift in range(0, self._row_bits, TILE_BITS):
+                code = (board >> shift) & col_mask
+                new_code = table.get(code)
+                if new_code is None:
+                    new_code = move_line(table, code, self._grid_height,
+                                         reverse, self._grid_width)
+                new_board |= new_code << shift
+        return new_board
+
+    def move_score(self, board, direction):
+        """
+        Returns the points scored by moving board in the given direction.
+        """
+        score = 0
+        if direction == LEFT or direction == RIGHT:
+            reverse = direction == RIGHT
+            for row in range(self._grid_height):
+                code = (board >> (row * self._row_bits)) & self._row_mask
+                score += line_score(code, self._grid_width, reverse)
+        else:
+            reverse = direction == DOWN
+            for col in range(self._grid_width):
+                score += line_score(self.get_column(board, col),
+                                    self._grid_height, reverse)
+        return score
+
+    def move(self, direction):
+        """
+        Moves all tiles in the given direction and adds
+        a new tile if any tiles moved.
+        """
+        board = self._board
+        new_board = self.moved_board(board, direction)
+        if new_board != board:
+            self._board = new_board
+            self.new_tile()
+
+    def new_tile(self):
+        """
+        Creates a new tile in a randomly selected empty
+        square.  The tile should be 2 90% of the time and
+        4 10% of the time.
+        """
+        board = self._board
+        occupied = board | (board >> 1)
+        occupied |= occupied >> 2
+        chosen = random_empty_shift(~occupied & self._empty_ones, self._rng)
+        prob = self._rng.randint(1, 10)
+        if prob <= 9:
+            self._board = board | (TILE_CODES[2] << chosen)
+        else:
+            self._board = board | (TILE_CODES[4] << chosen)
+
+    def set_tile(self, row, col, value):
+        """
+        Sets the tile at position row, col to have the given value.
+        """
+        shift = TILE_BITS * (row * self._grid_width + col)
+        self._board = ((self._board & ~(TILE_MASK << shift)) |
+                       (TILE_CODES[value] << shift))
+
+    def get_tile(self, row, col):
+        """
+        Returns the value of the tile at position row, col.
+        """
+        shift = TILE_BITS * (row * self._grid_width + col)
+        return TILE_VALUES[(self._board >> shift) & TILE_MASK]
+
+
+# (line length) -> (moved line code, points) NumPy arrays over all codes
+_BATCH_TABLES = {}
+
+class BatchTwentyFortyEight:
+    """
+    Runs many games of the same size side by side for headless
+    simulations.  The boards are one NumPy (N, H, W) array of log2
+    tile codes (0 for empty), and moves, merges and new tiles are
+    computed for all boards at once.  Lines up to EAGER_LINE_LENGTH
+    tiles are moved through a lookup table over all line codes,
+    longer lines are merged directly.  As in the bitboard version,
+    tiles are limited to 32768.
+    """
+
+    def __init__(self, num_boards, grid_height, grid_width, seed=None):
+        # not available in CodeSkulptor
+        import numpy
+        self._np = numpy
+        self._num_boards = num_boards
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        self._num_cells = grid_height * grid_width
+        self._rng = numpy.random.RandomState(seed)
+        self.reset()
+
+    def reset(self):
+        """
+        Resets every board to an empty grid with two initial tiles.
+        """
+        np = self._np
+        self._grids = np.zeros((self._num_boards, self._grid_height,
+                                self._grid_width), dtype=np.int8)
+        everyone = np.arange(self._num_boards)
+        self._spawn(everyone)
+        self._spawn(everyone)
+        self._scores = np.zeros(self._num_boards, dtype=np.int64)
+        self._moves = np.zeros(self._num_boards, dtype=np.int64)
+
+    def get_num_boards(self):
+        """
+        Returns the number of boards.
+        """
+        return self._num_boards
+
+    def get_grids(self):
+        """
+        Returns a copy of the (N, H, W) array of tile codes.
+        """
+        return self._grids.copy()
+
+    def get_boards(self):
+        """
+        Returns the list of packed boards.
+        """
+        codes = self._np.minimum(self._grids, TILE_MASK)
+        codes = codes.reshape(self._num_boards, -1).tolist()
+        boards = []
+        for cells in codes:
+            board = 0
+            for index in range(len(cells) - 1, -1, -1):
+                board = (board << TILE_BITS) | cells[index]
+            boards.append(board)
+        return boards
+
+    def get_scores(self):
+        """
+        Returns a copy of the list of scores.
+        """
+        return self._scores.tolist()
+
+    def get_moves(self):
+        """
+        Returns a copy of the list of move counts.
+        """
+        return self._moves.tolist()
+
+    def get_tile(self, index, row, col):
+        """
+        Returns the value of the tile at position row, col of board index.
+        """
+        code = int(self._grids[index, row, col])
+        if code == 0:
+            return 0
+        return 2 ** code
+
+    def _lines(self, grids, direction, inverse=False):
+        """
+        Returns a view of grids in which every board moves to the left,
+        or with inverse set, undoes that view.
+        """
+        turn = direction == UP or direction == DOWN
+        if turn and not inverse:
+            grids = grids.transpose(0, 2, 1)
+        if direction == RIGHT or direction == DOWN:
+            grids = grids[:, :, ::-1]
+        if turn and inverse:
+            grids = grids.transpose(0, 2, 1)
+        return grids
+
+    def _compact(self, lines):
+        """
+        Returns the (M, L) array lines with their tiles slid to the left.
+        """
+        np = self._np
+        order = np.argsort(lines == 0, axis=1, kind="mergesort")
+        return lines[np.arange(len(lines))[:, None], order]
+
+    def _merge_lines(self, lines):
+        """
+        Returns (lines moved to the left, points scored per line)
+        for an (M, L) array of lines, with the semantics of merge().
+        """
+        np = self._np
+        lines = self._compact(lines)
+        points = np.zeros(len(lines), dtype=np.int64)
+        for col in range(lines.shape[1] - 1):
+            merged = (lines[:, col] != 0) & (lines[:, col] == lines[:, col + 1])
+            codes = lines[merged, col].astype(np.int64) + 1
+            points[merged] += np.left_shift(1, codes)
+            lines[merged, col] = np.minimum(codes, TILE_MASK)
+            lines[merged, col + 1] = 0
+        return self._compact(lines), points
+
+    def _encode(self, lines):
+        """
+        Returns the packed line codes of an (M, L) array of lines.
+        """
+        np = self._np
+        codes = np.zeros(len(lines), dtype=np.int64)
+        for col in range(lines.shape[1]):
+            codes |= lines[:, col].astype(np.int64) << (TILE_BITS * col)
+        return codes
+
+    def _decode(self, codes, length):
+        """
+        Returns the (M, length) array of lines for packed line codes.
+        """
+        np = self._np
+        shifts = TILE_BITS * np.arange(length, dtype=np.int64)
+        return ((codes[:, None] >> shifts) & TILE_MASK).astype(np.int8)
+
+    def _line_tables(self, length):
+        """
+        Returns arrays (moved line code, points scored) indexed by
+        line code, for every line of the given length.
+        """
+        if length not in _BATCH_TABLES:
+            np = self._np
+            lines = self._decode(np.arange(16 ** length, dtype=np.int64), length)
+            moved, points = self._merge_lines(lines)
+            _BATCH_TABLES[length] = (self._encode(moved), points)
+        return _BATCH_TABLES[length]
+
+    def _moved(self, grids, direction):
+        """
+        Returns (moved grids, points scored per board) for moving every
+        board of grids in the given direction, without new tiles.
+        """
+        view = self._lines(grids, direction)
+        shape = view.shape
+        lines = view.reshape(-1, shape[2])
+        if shape[2] <= EAGER_LINE_LENGTH:
+            moved_codes, line_points = self._line_tables(shape[2])
+            codes = self._encode(lines)
+            lines = self._decode(moved_codes[codes], shape[2])
+            points = line_points[codes]
+        else:
+            lines, points = self._merge_lines(lines)
+        moved = self._lines(lines.reshape(shape), direction, True)
+        return moved, points.reshape(shape[0], shape[1]).sum(axis=1)
+
+    def _spawn(self, indices):
+        """
+        Adds a 2 (90%) or 4 (10%) in a random empty cell of each board
+        in indices that has an empty cell.
+        """
+        np = self._np
+        empty = self._grids[indices].reshape(len(indices), self._num_cells) == 0
+        counts = empty.sum(axis=1)
+        has_room = counts > 0
+        indices = indices[has_room]
+        empty = empty[has_room]
+        counts = counts[has_room]
+        picks = (self._rng.random_sample(len(indices)) * counts).astype(np.int64)
+        cell = np.argmax(np.cumsum(empty, axis=1) > picks[:, None], axis=1)
+        codes = np.where(self._rng.random_sample(len(indices)) < 0.9, 1, 2)
+        width = self._grid_width
+        self._grids[indices, cell // width, cell % width] = codes
+
+    def _step(self, indices, directions):
+        """
+        Moves board indices[i] in directions[i] for every i and adds a
+        new tile to each board that changed.  Returns a boolean array,
+        True where the board changed.
+        """
+        np = self._np
+        changed = np.zeros(len(indices), dtype=bool)
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            selected = np.nonzero(directions == direction)[0]
+            if len(selected) == 0:
+                continue
+            boards = indices[selected]
+            grids = self._grids[boards]
+            moved, points = self._moved(grids, direction)
+            differs = (moved != grids).any(axis=(1, 2))
+            done = boards[differs]
+            self._grids[done] = moved[differs]
+            self._scores[done] += points[differs]
+            self._moves[done] += 1
+            changed[selected] = differs
+        self._spawn(indices[changed])
+        return changed
+
+    def move(self, directions):
+        """
+        Moves every board, in a single direction or in the matching
+        entry of a list of directions (None leaves a board alone), and
+        adds a new tile to each board that changed.  Returns the list
+        of indices of the boards that did not change.
+        """
+        np = self._np
+        if not isinstance(directions, list):
+            directions = [directions] * self._num_boards
+        indices = np.array([index for index in range(self._num_boards)
+                            if directions[index] is not None], dtype=np.int64)
+        codes = np.array([directions[index] for index in indices.tolist()],
+                         dtype=np.int64)
+        changed = self._step(indices, codes)
+        return indices[~changed].tolist()
+
+    def _can_move_all(self, indices):
+        """
+        Returns a boolean array, True where board indices[i] can move.
+        """
+        grids = self._grids[indices]
+        # a board can move if it has an empty cell or two equal neighbours
+        movable = (grids == 0).any(axis=(1, 2))
+        movable |= ((grids[:, :, 1:] == grids[:, :, :-1]) &
+                    (grids[:, :, 1:] != 0)).any(axis=(1, 2))
+        movable |= ((grids[:, 1:, :] == grids[:, :-1, :]) &
+                    (grids[:, 1:, :] != 0)).any(axis=(1, 2))
+        return movable
+
+    def can_move(self, index):
+        """
+        Returns True if some direction changes board index.
+        """
+        return bool(self._can_move_all(self._np.array([index]))[0])
+
+    def play_random(self, max_moves=None):
+        """
+        Plays every board with uniformly random moves until none can
+        move (or max_moves rounds have been played).
+        """
+        np = self._np
+        active = np.arange(self._num_boards)
+        active = active[self._can_move_all(active)]
+        rounds = 0
+        while len(active) > 0 and (max_moves is None or rounds < max_moves):
+            directions = self._rng.randint(1, 5, len(active))
+            keep = self._step(active, directions)
+            # only a board that failed to move can be finished
+            keep[~keep] = self._can_move_all(active[~keep])
+            active = active[keep]
+            rounds += 1
+
+    def max_tile_distribution(self):
+        """
+        Returns a dictionary mapping each largest tile value
+        to the number of boards that reached it.
+        """
+        best = self._grids.reshape(self._num_boards, -1).max(axis=1)
+        distribution = {}
+        for code, count in enumerate(self._np.bincount(best).tolist()):
+            if count:
+                distribution[2 ** code if code else 0] = count
+        return distribution
+
+
+def pack_board(game):
+    """
+    Returns the packed board for any game with get_tile().
+    """
+    board = 0
+    width = game.get_grid_width()
+    for row in range(game.get_grid_height()):
+        for col in range(width):
+            shift = TILE_BITS * (row * width + col)
+            board |= TILE_CODES[game.get_tile(row, col)] << shift
+    return board
+
+
+# Expectimax player. Heuristic weights for a single row or column,
+# the board score is the sum over all rows and columns.
+HEURISTIC_EMPTY = 270.0
+HEURISTIC_MERGES = 700.0
+HEURISTIC_MONOTONICITY = 47.0
+HEURISTIC_MONOTONICITY_POWER = 4.0
+HEURISTIC_SUM = 11.0
+HEURISTIC_SUM_POWER = 3.5
+HEURISTIC_BASE = 200000.0
+
+# Spawn probabilities used by new_tile()
+SPAWN_TWO_PROB = 0.9
+SPAWN_FOUR_PROB = 0.1
+
+# Chance branches less likely than this are scored by the heuristic
+MIN_BRANCH_PROB = 0.0001
+
+# (line length) -> {line code: heuristic score}
+_HEURISTIC_TABLES = {}
+
+def line_heuristic(code, length):
+    """
+    Scores a single packed row or column: rewards empty cells,
+    possible merges and monotonic lines, penalizes large tiles.
+    """
+    table = _HEURISTIC_TABLES.setdefault(length, {})
+    if code in table:
+        return table[code]
+    ranks = []
+    for index in range(length):
+        ranks.append((code >> (TILE_BITS * index)) & TILE_MASK)
+    empty = 0
+    merges = 0
+    tile_sum = 0.0
+    previous = 0
+    counter = 0
+    for rank in ranks:
+        tile_sum += rank ** HEURISTIC_SUM_POWER
+        if rank == 0:
+            empty += 1
+        else:
+            if previous == rank:
+                counter += 1
+            elif counter > 0:
+                merges += 1 + counter
+                counter = 0
+            previous = rank
+    if counter > 0:
+        merges += 1 + counter
+    mono_left = 0.0
+    mono_right = 0.0
+    for index in range(1, length):
+        if ranks[index - 1] > ranks[index]:
+            mono_left += (ranks[index - 1] ** HEURISTIC_MONOTONICITY_POWER -
+                          ranks[index] ** HEURISTIC_MONOTONICITY_POWER)
+        else:
+            mono_right += (ranks[index] ** HEURISTIC_MONOTONICITY_POWER -
+                           ranks[index - 1] ** HEURISTIC_MONOTONICITY_POWER)
+    score = (HEURISTIC_BASE + HEURISTIC_EMPTY * empty +
+             HEURISTIC_MERGES * merges -
+             HEURISTIC_MONOTONICITY * min(mono_left, mono_right) -
+             HEURISTIC_SUM * tile_sum)
+    table[code] = score
+    return score
+
+
+class ExpectimaxCache:
+    """
+    Bounded cache of evaluated positions.  Keeps two generations of
+    entries and drops the older one when the newer one fills up.
+    """
+
+    def __init__(self, capacity):
+        self._capacity = max(2, capacity)
+        self._current = {}
+        self._previous = {}
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None.
+        """
+        value = self._current.get(key)
+        if value is None:
+            value = self._previous.get(key)
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """
+        Stores value for key, evicting the older generation if needed.
+        """
+        if len(self._current) >= self._capacity // 2:
+            self._previous = self._current
+            self._current = {}
+        self._current[key] = value
+
+    def clear(self):
+        """
+        Drops all cached entries.
+        """
+        self._current = {}
+        self._previous = {}
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget runs out.
+    """
+    pass
+
+
+class ExpectimaxPlayer:
+    """
+    Picks moves for a 2048 game by expectimax search: player moves
+    are max nodes, new tiles (2 or 4 in a random empty square) are
+    chance nodes.  The search deepens one move at a time until
+    max_depth is reached or time_limit seconds have passed.
+
+    The default time_limit leaves a margin under a 50 ms budget for
+    the last deadline check and packing the board.  Only values with
+    no chance branch cut off by MIN_BRANCH_PROB are cached, since
+    those do not depend on the probability of reaching the position.
+    """
+
+    def __init__(self, grid_height, grid_width, max_depth=3,
+                 time_limit=0.035, cache_size=200000):
+        self._engine = BitboardTwentyFortyEight(grid_height, grid_width)
+        self._num_cells = grid_height * grid_width
+        self._max_depth = max_depth
+        self._time_limit = time_limit
+        self._cache = ExpectimaxCache(cache_size)
+        self._deadline = None
+        self._cutoffs = 0
+
+    def get_cache(self):
+        """
+        Returns the transposition cache.
+        """
+        return self._cache
+
+    def evaluate(self, board):
+        """
+        Returns the heuristic score of a packed board.
+        """
+        engine = self._engine
+        height = engine.get_grid_height()
+        width = engine.get_grid_width()
+        row_mask = (1 << (TILE_BITS * width)) - 1
+        score = 0.0
+        for row in range(height):
+            score += line_heuristic((board >> (TILE_BITS * width * row)) & row_mask,
+                                    width)
+        for col in range(width):
+            score += line_heuristic(engine.get_column(board, col), height)
+        return score
+
+    def choose_move(self, game):
+        """
+        Returns the best direction for the given game,
+        or None if no move changes the board.
+        """
+        board = pack_board(game)
+        self._deadline = None
+        if self._time_limit is not None:
+            self._deadline = time.time() + self._time_limit
+        best_move = None
+        for depth in range(1, self._max_depth + 1):
+            try:
+                move = self._best_root_move(board, depth)
+            except SearchTimeout:
+                break
+            if move is None:
+                return None
+            best_move = move
+        if best_move is None:
+            best_move = self._any_move(board)
+        return best_move
+
+    def _any_move(self, board):
+        """
+        Returns the first direction that changes the board, or None.
+        """
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            if self._engine.moved_board(board, direction) != board:
+                return direction
+        return None
+
+    def _best_root_move(self, board, depth):
+        """
+        Returns the best direction searching depth player moves ahead.
+        """
+        best_score = None
+        best_move = None
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            new_board = self._engine.moved_board(board, direction)
+            if new_board != board:
+                score = self._chance_value(new_board, depth, 1.0)
+                if best_score is None or score > best_score:
+                    best_score = score
+                    best_move = direction
+        return best_move
+
+    def _max_value(self, board, depth, prob):
+        """
+        Value of a position where the player is to move.
+        """
+        if depth == 0:
+            return self.evaluate(board)
+        if self._deadline is not None and time.time() > self._deadline:
+            raise SearchTimeout()
+        best_score = 0.0
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            new_board = self._engine.moved_board(board, direction)
+            if new_board != board:
+                score = self._chance_value(new_board, depth, prob)
+                if score > best_score:
+                    best_score = score
+        return best_score
+
+    def _chance_value(self, board, depth, prob):
+        """
+        Value of a position right after a move, averaged over
+        all possible new tiles.
+        """
+        if self._deadline is not None and time.time() > self._deadline:
+            raise SearchTimeout()
+        # one int per key, cheaper to store and to evict than a tuple
+        key = (board << 8) | depth
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        empty = empty_cells(board, self._num_cells)
+        empty_shifts = []
+        while empty:
+            low = empty & -empty
+            empty ^= low
+            empty_shifts.append(low.bit_length() - 1)
+        if not empty_shifts:
+            return self.evaluate(board)
+        cutoffs = self._cutoffs
+        cell_prob = prob / len(empty_shifts)
+        if cell_prob * SPAWN_FOUR_PROB < MIN_BRANCH_PROB:
+            self._cutoffs += 1
+            score = self.evaluate(board)
+        else:
+            total = 0.0
+            for shift in empty_shifts:
+                total += SPAWN_TWO_PROB * self._max_value(
+                    board | (TILE_CODES[2] << shift), depth - 1,
+                    cell_prob * SPAWN_TWO_PROB)
+                total += SPAWN_FOUR_PROB * self._max_value(
+                    board | (TILE_CODES[4] << shift), depth - 1,
+                    cell_prob * SPAWN_FOUR_PROB)
+            score = total / len(empty_shifts)
+        if self._cutoffs == cutoffs:
+            self._cache.put(key, score)
+        return score
+
+
+# Replay log.  Each record takes two bytes:
+# bits 15-13 direction (0 for the initial tiles of a game),
+# bit 12 set if the new tile is a 4, bits 11-0 the new tile's cell index.
+LOG_MAGIC = bytearray("2048")
+LOG_HEADER_SIZE = 6
+LOG_MAX_CELLS = 4096
+# the header holds the height and width in one byte each
+LOG_MAX_SIDE = 255
+LOG_CHECKPOINT_INTERVAL = 256
+
+class GameLog:
+    """
+    Append-only record of a game: direction, new tile cell and new tile
+    value for every move.  Keeps a packed board every
+    LOG_CHECKPOINT_INTERVAL moves so replay() can start close to the
+    requested move.
+    """
+
+    def __init__(self, grid_height, grid_width):
+        assert grid_height * grid_width <= LOG_MAX_CELLS, "board too large to log"
+        assert grid_height <= LOG_MAX_SIDE and grid_width <= LOG_MAX_SIDE, \
+            "board side too long to log"
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        # only used for moved_board; its own seed keeps the initial tiles
+        # of its reset() from drawing on the global random state
+        self._engine = BitboardTwentyFortyEight(grid_height, grid_width, 0)
+        self.clear()
+
+    def __len__(self):
+        return len(self._records) // 2
+
+    def clear(self):
+        """
+        Drops all records.
+        """
+        self._records = bytearray()
+        self._num_moves = 0
+        self._board = 0
+        # (move number, number of records, packed board)
+        self._checkpoints = [(0, 0, 0)]
+
+    def get_num_moves(self):
+        """
+        Returns the number of moves recorded.
+        """
+        return self._num_moves
+
+    def record(self, direction, row, col, value):
+        """
+        Appends a record.  direction is None for the initial tiles.
+        """
+        cell = row * self._grid_width + col
+        dir_code = direction
+        if dir_code is None:
+            dir_code = 0
+        word = (dir_code << 13) | (cell & 0xFFF)
+        if value == 4:
+            word |= 1 << 12
+        self._records.append(word >> 8)
+        self._records.append(word & 0xFF)
+        self._apply(direction, cell, value)
+
+    def _apply(self, direction, cell, value):
+        """
+        Updates the packed board after a record and takes a
+        checkpoint every LOG_CHECKPOINT_INTERVAL moves.
+        """
+        if direction is not None:
+            self._board = self._engine.moved_board(self._board, direction)
+            self._num_moves += 1
+        self._board |= TILE_CODES[value] << (TILE_BITS * cell)
+        if direction is not None and self._num_moves % LOG_CHECKPOINT_INTERVAL == 0:
+            self._checkpoints.append((self._num_moves, len(self), self._board))
+
+    def get_record(self, index):
+        """
+        Returns record index as a tuple (direction, row, col, value).
+        """
+        word = (self._records[2 * index] << 8) | self._records[2 * index + 1]
+        direction = word >> 13
+        if direction == 0:
+            direction = None
+        cell = word & 0xFFF
+        value = 2
+        if word & (1 << 12):
+            value = 4
+        return (direction, cell // self._grid_width, cell % self._grid_width, value)
+
+    def to_bytes(self):
+        """
+        Returns the log as a byte string: "2048", height, width, records.
+        """
+        data = bytearray(LOG_MAGIC)
+        data.append(self._grid_height)
+        data.append(self._grid_width)
+        return bytes(data + self._records)
+
+    def replay_board(self, num_moves):
+        """
+        Returns the packed board after the first num_moves moves.
+        """
+        assert 0 <= num_moves <= self._num_moves, "move not in log"
+        start = self._checkpoints[num_moves // LOG_CHECKPOINT_INTERVAL]
+        moves, index, board = start
+        while index < len(self):
+            word = (self._records[2 * index] << 8) | self._records[2 * index + 1]
+            direction = word >> 13
+            if direction != 0:
+                if moves == num_moves:
+                    break
+                board = self._engine.moved_board(board, direction)
+                moves += 1
+            code = TILE_CODES[2]
+            if word & (1 << 12):
+                code = TILE_CODES[4]
+            board |= code << (TILE_BITS * (word & 0xFFF))
+            index += 1
+        return board
+
+    def replay(self, num_moves):
+        """
+        Returns a TwentyFortyEight game in the state it was in
+        after the first num_moves moves.
+        """
+        board = self.replay_board(num_moves)
+        game = TwentyFortyEight(self._grid_height, self._grid_width)
+        for row in range(self._grid_height):
+            for col in range(self._grid_width):
+                shift = TILE_BITS * (row * self._grid_width + col)
+                game.set_tile(row, col, TILE_VALUES[(board >> shift) & TILE_MASK])
+        return game
+
+
+def load_game_log(data):
+    """
+    Rebuilds a GameLog (and its checkpoints) from GameLog.to_bytes().
+    """
+    data = bytearray(data)
+    assert data[:4] == LOG_MAGIC, "not a 2048 game log"
+    log_width = data[5]
+    log = GameLog(data[4], log_width)
+    for index in range(LOG_HEADER_SIZE, len(data) - 1, 2):
+        word = (data[index] << 8) | data[index + 1]
+        direction = word >> 13
+        if direction == 0:
+            direction = None
+        value = 2
+        if word & (1 << 12):
+            value = 4
+        cell = word & 0xFFF
+        log.record(direction, cell // log_width, cell % log_width, value)
+    return log
+
+
 #import user45_g0J17uPiBz_19 as test_suite
 #test_suite.run_suite(TwentyFortyEight)
 poc_2048_gui.run_gui(TwentyFortyEight(4, 5))
@@ -0,0 +1,209 @@
+"""
+Bitboard Tic-Tac-Toe board
+
+Drop-in replacement for poc_ttt_provided.TTTBoard: the squares of each
+player are bits of one integer (square row * dim + col), wins are found
+by testing only the lines through the last move, and unmove() takes a
+move back so searches do not need to clone the board.
+"""
+
+import poc_ttt_provided as provided
+
+# dim -> (list of line masks, list of line masks through each square)
+_LINE_MASKS = {}
+
+def line_masks(dim):
+    """
+    Returns the bit masks of all rows, columns and diagonals, and
+    for each square the masks of the lines through it.
+    """
+    if dim not in _LINE_MASKS:
+        all_lines = []
+        for idx in range(dim):
+            row_mask = 0
+            col_mask = 0
+            for other in range(dim):
+                row_mask |= 1 << (idx * dim + other)
+                col_mask |= 1 << (other * dim + idx)
+            all_lines.append(row_mask)
+            all_lines.append(col_mask)
+        diag = 0
+        anti_diag = 0
+        for idx in range(dim):
+            diag |= 1 << (idx * dim + idx)
+            anti_diag |= 1 << (idx * dim + dim - 1 - idx)
+        all_lines.append(diag)
+        all_lines.append(anti_diag)
+        cell_lines = []
+        for idx in range(dim * dim):
+            cell_lines.append([mask for mask in all_lines if mask & (1 << idx)])
+        _LINE_MASKS[dim] = (all_lines, cell_lines)
+    return _LINE_MASKS[dim]
+
+
+class BitboardTTTBoard:
+    """
+    Class to represent a Tic-Tac-Toe board as two bit masks.
+    """
+
+    def __init__(self, dim, reverse=False, board=None):
+        self._dim = dim
+        self._reverse = reverse
+        self._full = (1 << (dim * dim)) - 1
+        self._lines, self._cell_lines = line_masks(dim)
+        self._masks = {provided.PLAYERX: 0, provided.PLAYERO: 0}
+        self._winner = None
+        if board is not None:
+            for row in range(dim):
+                for col in range(dim):
+                    if board[row][col] != provided.EMPTY:
+                        self.move(row, col, board[row][col])
+
+    def __str__(self):
+        """
+        Human readable representation of the board.
+        """
+        rep = ""
+        for row in range(self._dim):
+            for col in range(self._dim):
+                rep += provided.STRMAP[self.square(row, col)]
+                if col == self._dim - 1:
+                    rep += "\n"
+                else:
+                    rep += " | "
+            if row != self._dim - 1:
+                rep += "-" * (4 * self._dim - 3)
+                rep += "\n"
+        return rep
+
+    def get_dim(self):
+        """
+        Return the dimension of the board.
+        """
+        return self._dim
+
+    def get_masks(self):
+        """
+        Returns the bit masks of PLAYERX and PLAYERO.
+        """
+        return self._masks[provided.PLAYERX], self._masks[provided.PLAYERO]
+
+    def square(self, row, col):
+        """
+        Returns one of the three constants EMPTY, PLAYERX, or PLAYERO
+        that correspond to the contents of the board at position (row, col).
+        """
+        bit = 1 << (row * self._dim + col)
+        if self._masks[provided.PLAYERX] & bit:
+            return provided.PLAYERX
+        if self._masks[provided.PLAYERO] & bit:
+            return provided.PLAYERO
+        return provided.EMPTY
+
+    def get_empty_squares(self):
+        """
+        Return a list of (row, col) tuples for all empty squares
+        """
+        empty = self._full & ~(self._masks[provided.PLAYERX] |
+                               self._masks[provided.PLAYERO])
+        squares = []
+        for idx in range(self._dim * self._dim):
+            if empty & (1 << idx):
+                squares.append((idx // self._dim, idx % self._dim))
+        return squares
+
+    def move(self, row, col, player):
+        """
+        Place player on the board at position (row, col).
+        Does nothing if board square is not empty.
+        """
+        idx = row * self._dim + col
+        bit = 1 << idx
+        if (self._masks[provided.PLAYERX] | self._masks[provided.PLAYERO]) & bit:
+            return
+        pieces = self._masks[player] | bit
+        self._masks[player] = pieces
+        if self._winner is None:
+            for mask in self._cell_lines[idx]:
+                if pieces & mask == mask:
+                    self._winner = player
+                    break
+
+    def unmove(self, row, col):
+        """
+        Empties the square at position (row, col).
+        """
+        bit = 1 << (row * self._dim + col)
+        for player in (provided.PLAYERX, provided.PLAYERO):
+            self._masks[player] &= ~bit
+        if self._winner is not None:
+            self._winner = None
+            for player in (provided.PLAYERX, provided.PLAYERO):
+                pieces = self._masks[player]
+                for mask in self._lines:
+                    if pieces & mask == mask:
+                        self._winner = player
+
+    def check_win(self):
+        """
+        Returns a constant associated with the state of the game
+            If PLAYERX wins, returns PLAYERX.
+            If PLAYERO wins, returns PLAYERO.
+            If game is drawn, returns DRAW.
+            If game is in progress, returns None.
+        """
+        if self._winner is not None:
+            if self._reverse:
+                return provided.switch_player(self._winner)
+            return self._winner
+        if self._masks[provided.PLAYERX] | self._masks[provided.PLAYERO] == self._full:
+            return provided.DRAW
+        return None
+
+    def clone(self):
+        """
+        Return a copy of the board.
+        """
+        new_board = BitboardTTTBoard(self._dim, self._reverse)
+        new_board._masks = dict(self._masks)
+        new_board._winner = self._winner
+        return new_board
+
+
+def is_reverse(board):
+    """
+    Returns True if board plays the reverse game, where completing a
+    line loses.  TTTBoard does not expose its flag, so a clone gets a
+    line filled with one player's pieces and is asked who won.  If no
+    line can be completed any more, both games are the same and the
+    answer is False.
+    """
+    dim = board.get_dim()
+    for player in (provided.PLAYERX, provided.PLAYERO):
+        for mask in line_masks(dim)[0]:
+            squares = [(idx // dim, idx % dim) for idx in range(dim * dim)
+                       if mask & (1 << idx)]
+            if all([board.square(row, col) in (provided.EMPTY, player)
+                    for row, col in squares]):
+                clone = board.clone()
+                for row, col in squares:
+                    clone.move(row, col, player)
+                return clone.check_win() != player
+    return False
+
+
+def from_board(board, reverse=None):
+    """
+    Returns a BitboardTTTBoard with the same squares as board, playing
+    the reverse game if reverse is True, or the same game as board if
+    reverse is None.
+    """
+    if reverse is None:
+        reverse = is_reverse(board)
+    dim = board.get_dim()
+    new_board = BitboardTTTBoard(dim, reverse)
+    for row in range(dim):
+        for col in range(dim):
+            if board.square(row, col) != provided.EMPTY:
+                new_board.move(row, col, board.square(row, col))
+    return new_board
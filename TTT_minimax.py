@@ -2,8 +2,10 @@
 Mini-max Tic-Tac-Toe Player
 """
 
+import time
 import poc_ttt_gui
 import poc_ttt_provided as provided
+import TTT_bitboard
 
 # Set timeout, as mini-max can take a long time
 import codeskulptor
@@ -47,12 +49,452 @@ def mm_move(board, player):
 #returned bad move (-1, (2, 2))    
                 
 
+# Alpha-beta search with a transposition table.  Positions are stored
+# under the smallest of their 8 rotations and reflections, so symmetric
+# positions are only solved once.  In the reverse game, completing a
+# line loses instead of winning.
+
+# Transposition table entry flags
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# dim -> list of index permutations, list of lines, lines through each cell
+_SYMMETRIES = {}
+_LINES = {}
+_CELL_LINES = {}
+
+# (dim, reverse) -> {(canonical squares, player): (flag, score)}
+_TRANSPOSITIONS = {}
+
+def symmetries(dim):
+    """
+    Returns the 8 rotations and reflections of a dim x dim board
+    as lists of square indices.
+    """
+    if dim not in _SYMMETRIES:
+        perms = []
+        for rotation in range(4):
+            for reflect in (False, True):
+                perm = []
+                for row in range(dim):
+                    for col in range(dim):
+                        src_row, src_col = row, col
+                        if reflect:
+                            src_col = dim - 1 - src_col
+                        for dummy_turn in range(rotation):
+                            src_row, src_col = src_col, dim - 1 - src_row
+                        perm.append(src_row * dim + src_col)
+                if perm not in perms:
+                    perms.append(perm)
+        _SYMMETRIES[dim] = perms
+    return _SYMMETRIES[dim]
+
+def lines(dim):
+    """
+    Returns all rows, columns and diagonals as tuples of square indices,
+    and for each square the lines that go through it.
+    """
+    if dim not in _LINES:
+        all_lines = []
+        for idx in range(dim):
+            all_lines.append(tuple([idx * dim + col for col in range(dim)]))
+            all_lines.append(tuple([row * dim + idx for row in range(dim)]))
+        all_lines.append(tuple([idx * dim + idx for idx in range(dim)]))
+        all_lines.append(tuple([idx * dim + dim - 1 - idx for idx in range(dim)]))
+        cell_lines = [[] for dummy_idx in range(dim * dim)]
+        for line in all_lines:
+            for idx in line:
+                cell_lines[idx].append(line)
+        _LINES[dim] = all_lines
+        _CELL_LINES[dim] = cell_lines
+    return _LINES[dim], _CELL_LINES[dim]
+
+def canonical(squares, dim):
+    """
+    Returns the smallest symmetric image of squares.
+    """
+    best = None
+    for perm in symmetries(dim):
+        image = tuple([squares[idx] for idx in perm])
+        if best is None or image < best:
+            best = image
+    return best
+
+def square_order(dim):
+    """
+    Returns square indices ordered from the center outwards.
+    """
+    center = (dim - 1) / 2.0
+    order = range(dim * dim)
+    order.sort(key=lambda idx: abs(idx // dim - center) + abs(idx % dim - center))
+    return order
+
+def completes_line(squares, idx, dim):
+    """
+    Checks whether the piece on square idx completes a line.
+    """
+    player = squares[idx]
+    for line in lines(dim)[1][idx]:
+        won = True
+        for other in line:
+            if squares[other] != player:
+                won = False
+                break
+        if won:
+            return True
+    return False
+
+def ab_value(squares, player, alpha, beta, dim, empty, order, table,
+             reverse=False):
+    """
+    Returns the score (from PLAYERX's point of view) of squares with
+    player to move, searched within the window (alpha, beta).
+    """
+    if empty == 0:
+        return SCORES[provided.DRAW]
+    key = (canonical(squares, dim), player)
+    entry = table.get(key)
+    if entry is not None:
+        flag, value = entry
+        if flag == EXACT:
+            return value
+        if flag == LOWER and value >= beta:
+            return value
+        if flag == UPPER and value <= alpha:
+            return value
+    orig_alpha, orig_beta = alpha, beta
+    sign = SCORES[player]
+    line_value = sign
+    if reverse:
+        line_value = -sign
+    best = None
+    other = provided.switch_player(player)
+    for idx in order:
+        if squares[idx] != provided.EMPTY:
+            continue
+        squares[idx] = player
+        if completes_line(squares, idx, dim):
+            value = line_value
+        else:
+            value = ab_value(squares, other, alpha, beta, dim,
+                             empty - 1, order, table, reverse)
+        squares[idx] = provided.EMPTY
+        if best is None or value * sign > best * sign:
+            best = value
+        if sign > 0:
+            alpha = max(alpha, value)
+        else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            break
+    if best <= orig_alpha:
+        table[key] = (UPPER, best)
+    elif best >= orig_beta:
+        table[key] = (LOWER, best)
+    else:
+        table[key] = (EXACT, best)
+    return best
+
+def ab_best_square(squares, player, dim, reverse=False):
+    """
+    Searches a non-terminal position given as a flat list of squares.
+    Returns a tuple (score, index of the best square).
+    """
+    empty = squares.count(provided.EMPTY)
+    order = square_order(dim)
+    table = _TRANSPOSITIONS.setdefault((dim, reverse), {})
+    sign = SCORES[player]
+    line_value = sign
+    if reverse:
+        line_value = -sign
+    other = provided.switch_player(player)
+    best_score = None
+    best_idx = -1
+    for idx in order:
+        if squares[idx] != provided.EMPTY:
+            continue
+        squares[idx] = player
+        if completes_line(squares, idx, dim):
+            value = line_value
+        else:
+            # a window just above the best so far only proves improvements
+            alpha, beta = -2, 2
+            if best_score is not None:
+                if sign > 0:
+                    alpha = best_score
+                else:
+                    beta = best_score
+            value = ab_value(squares, other, alpha, beta, dim,
+                             empty - 1, order, table, reverse)
+        squares[idx] = provided.EMPTY
+        if best_score is None or value * sign > best_score * sign:
+            best_score = value
+            best_idx = idx
+        if best_score == sign:
+            break
+    return best_score, best_idx
+
+def ab_move(board, player):
+    """
+    Alpha-beta version of mm_move, same return value: a tuple
+    (score, (row, col)).  Plays the standard or reverse game,
+    whichever board plays.
+    """
+    if board.check_win() != None:
+        return SCORES[board.check_win()], (-1, -1)
+    dim = board.get_dim()
+    squares = [board.square(idx // dim, idx % dim) for idx in range(dim * dim)]
+    best_score, best_idx = ab_best_square(squares, player, dim,
+                                          TTT_bitboard.is_reverse(board))
+    return best_score, (best_idx // dim, best_idx % dim)
+
+
+# Iterative deepening search for boards too large to solve.  Searches
+# one ply deeper at a time until the time budget runs out and scores
+# unfinished positions at the depth limit with heuristic_value().
+ID_BUDGET_MS = 200
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget runs out.
+    """
+    pass
+
+def heuristic_value(squares, dim, reverse=False):
+    """
+    Estimates a position from PLAYERX's point of view, strictly
+    between -1 and 1: every line still open for one player counts
+    the square of the number of pieces that player has on it, for
+    that player in the standard game and against them in the
+    reverse game.
+    """
+    all_lines = lines(dim)[0]
+    total = 0
+    for line in all_lines:
+        num_x = 0
+        num_o = 0
+        for idx in line:
+            if squares[idx] == provided.PLAYERX:
+                num_x += 1
+            elif squares[idx] == provided.PLAYERO:
+                num_o += 1
+        if num_o == 0:
+            total += num_x * num_x
+        elif num_x == 0:
+            total -= num_o * num_o
+    if reverse:
+        total = -total
+    return float(total) / (len(all_lines) * dim * dim)
+
+def id_value(squares, player, depth, alpha, beta, dim, empty, order, pv,
+             deadline, reverse=False):
+    """
+    Depth limited alpha-beta search over squares in the given order.
+    Tries the move from the previous principal variation pv first.
+    Returns a tuple (score from PLAYERX's point of view, principal
+    variation as square indices).  In the reverse game completing a
+    line loses.
+    """
+    if time.time() > deadline:
+        raise SearchTimeout()
+    if empty == 0:
+        return SCORES[provided.DRAW], []
+    if depth == 0:
+        return heuristic_value(squares, dim, reverse), []
+    moves = order
+    if pv and squares[pv[0]] == provided.EMPTY:
+        moves = [pv[0]] + [idx for idx in order if idx != pv[0]]
+    sign = SCORES[player]
+    line_value = sign
+    if reverse:
+        line_value = -sign
+    other = provided.switch_player(player)
+    best = None
+    best_line = []
+    for idx in moves:
+        if squares[idx] != provided.EMPTY:
+            continue
+        squares[idx] = player
+        if completes_line(squares, idx, dim):
+            value, line = line_value, []
+        else:
+            child_pv = []
+            if pv and idx == pv[0]:
+                child_pv = pv[1:]
+            value, line = id_value(squares, other, depth - 1, alpha, beta,
+                                   dim, empty - 1, order, child_pv, deadline,
+                                   reverse)
+        squares[idx] = provided.EMPTY
+        if best is None or value * sign > best * sign:
+            best = value
+            best_line = [idx] + line
+        if sign > 0:
+            alpha = max(alpha, value)
+        else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            break
+    return best, best_line
+
+def id_move(board, player, budget_ms=ID_BUDGET_MS):
+    """
+    Anytime version of mm_move: deepens the search until budget_ms
+    milliseconds have passed and returns the result of the deepest
+    finished search, (score, (row, col)).  Scores strictly between
+    -1 and 1 are heuristic estimates.  Plays the standard or reverse
+    game, whichever board plays.
+    """
+    if board.check_win() != None:
+        return SCORES[board.check_win()], (-1, -1)
+    deadline = time.time() + budget_ms / 1000.0
+    dim = board.get_dim()
+    squares = [board.square(idx // dim, idx % dim) for idx in range(dim * dim)]
+    empty = squares.count(provided.EMPTY)
+    order = square_order(dim)
+    reverse = TTT_bitboard.is_reverse(board)
+    # before the first search finishes, any empty square will do
+    best_score = SCORES[provided.DRAW]
+    best_pv = [squares.index(provided.EMPTY)]
+    for depth in range(1, empty + 1):
+        try:
+            score, line = id_value(squares, player, depth, -2, 2, dim,
+                                   empty, order, best_pv, deadline, reverse)
+        except SearchTimeout:
+            break
+        best_score, best_pv = score, line
+        if abs(score) == 1:
+            break
+    return best_score, (best_pv[0] // dim, best_pv[0] % dim)
+
+
+# Tablebase: every position reachable from the empty board (with either
+# player starting) solved once and written to a file, one file per
+# board size and game variant.  The header is the magic, the dimension
+# and 1 for the reverse game (0 otherwise).  Each position gets one
+# byte at offset TABLEBASE_HEADER_SIZE + 2 * rank + (player is
+# PLAYERO), where rank reads the squares as a base 3 number (empty 0,
+# X 1, O 2, first square least significant).  The byte holds
+# (score + 2) in its top two bits and the best square index below, or
+# 0 for positions that are finished or unreachable.
+TABLEBASE_MAGIC = "TTTB"
+TABLEBASE_HEADER_SIZE = 6
+TABLEBASE_FILE = "ttt_tablebase_%d.bin"
+TABLEBASE_REVERSE_FILE = "ttt_tablebase_%d_reverse.bin"
+
+DIGITS = {provided.EMPTY: 0,
+          provided.PLAYERX: 1,
+          provided.PLAYERO: 2}
+
+# filename -> memory map of the file
+_TABLEBASES = {}
+
+def tablebase_header(dim, reverse):
+    """
+    Returns the header of the tablebase file for dim and variant.
+    """
+    return TABLEBASE_MAGIC + chr(dim) + chr(int(reverse))
+
+def tablebase_filename(dim, reverse):
+    """
+    Returns the default tablebase file name for dim and variant.
+    """
+    if reverse:
+        return TABLEBASE_REVERSE_FILE % dim
+    return TABLEBASE_FILE % dim
+
+def position_index(squares, player):
+    """
+    Returns the tablebase offset (without header) of a position.
+    """
+    rank = 0
+    for idx in range(len(squares) - 1, -1, -1):
+        rank = rank * 3 + DIGITS[squares[idx]]
+    if player == provided.PLAYERO:
+        return 2 * rank + 1
+    return 2 * rank
+
+def build_tablebase(dim, filename=None, reverse=False):
+    """
+    Solves every reachable dim x dim position of the standard or
+    reverse game and writes the tablebase file.  Returns the number
+    of positions solved.  Only practical up to dim 4 (86 MB file).
+    """
+    if filename is None:
+        filename = tablebase_filename(dim, reverse)
+    entries = bytearray(2 * 3 ** (dim * dim))
+    seen = set()
+    for first in (provided.PLAYERX, provided.PLAYERO):
+        stack = [([provided.EMPTY] * (dim * dim), first)]
+        while stack:
+            squares, player = stack.pop()
+            index = position_index(squares, player)
+            if index in seen:
+                continue
+            seen.add(index)
+            score, best_idx = ab_best_square(squares, player, dim, reverse)
+            entries[index] = ((score + 2) << 6) | best_idx
+            other = provided.switch_player(player)
+            for idx in range(dim * dim):
+                if squares[idx] == provided.EMPTY:
+                    child = list(squares)
+                    child[idx] = player
+                    if (not completes_line(child, idx, dim)
+                            and provided.EMPTY in child):
+                        stack.append((child, other))
+    table_file = open(filename, "wb")
+    table_file.write(tablebase_header(dim, reverse))
+    table_file.write(entries)
+    table_file.close()
+    return len(seen)
+
+def open_tablebase(dim, filename=None, reverse=False):
+    """
+    Memory maps the tablebase file for dim and variant, once.
+    Returns None if the file does not exist (or mmap is missing, as
+    in CodeSkulptor); a file built later is picked up on the next call.
+    """
+    if filename is None:
+        filename = tablebase_filename(dim, reverse)
+    if filename not in _TABLEBASES:
+        try:
+            import mmap
+            table_file = open(filename, "rb")
+        except (ImportError, IOError):
+            return None
+        table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        table_file.close()
+        assert table[:TABLEBASE_HEADER_SIZE] == tablebase_header(dim, reverse), \
+            "not a tablebase for this dimension and variant"
+        _TABLEBASES[filename] = table
+    return _TABLEBASES[filename]
+
+def tablebase_move(board, player, table):
+    """
+    Looks up a position in a memory mapped tablebase.  Same return
+    value as mm_move, or None if the position is not in the table.
+    """
+    dim = board.get_dim()
+    squares = [board.square(idx // dim, idx % dim) for idx in range(dim * dim)]
+    entry = ord(table[TABLEBASE_HEADER_SIZE + position_index(squares, player)])
+    if entry == 0:
+        return None
+    best_idx = entry & 63
+    return (entry >> 6) - 2, (best_idx // dim, best_idx % dim)
+
+
 def move_wrapper(board, player, trials):
     """
     Wrapper to allow the use of the same infrastructure that was used
     for Monte Carlo Tic-Tac-Toe.
     """
-    move = mm_move(board, player)
+    move = None
+    table = open_tablebase(board.get_dim(),
+                           reverse=TTT_bitboard.is_reverse(board))
+    if table is not None and board.check_win() == None:
+        move = tablebase_move(board, player, table)
+    if move is None:
+        move = ab_move(board, player)
     assert move[1] != (-1, -1), "returned illegal move (-1, -1)"
     return move[1]
 
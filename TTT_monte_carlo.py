@@ -2,14 +2,23 @@
 Monte Carlo Tic-Tac-Toe Player
 """
 
+import math
 import random
+import time
 import poc_ttt_gui
 import poc_ttt_provided as provided
+import TTT_bitboard
 
 # Constants for Monte Carlo simulator
 NTRIALS = 100         # Number of trials to run
 SCORE_CURRENT = 1.0 # Score for squares played by the current player
 SCORE_OTHER = 1.0   # Score for squares played by the other player
+USE_BITBOARD = True # Run the trials on a TTT_bitboard copy of the board
+CHUNK_TRIALS = 1000 # Trials per chunk (and per seed) in mc_parallel_scores
+UCT_EXPLORE = 1.4   # Exploration constant for the UCT tree search
+UCT_CHECK_EVERY = 50 # Trials between checks whether the best move is settled
+USE_NUMPY = True    # Run mc_batch_scores on NumPy arrays when NumPy is installed
+NUMPY_BLOCK = 10000 # Trials per array pass in mc_numpy_scores
     
     
 def mc_trial(board, player):
@@ -46,7 +55,7 @@ def mc_update_scores(scores,board,player):
                 if board.square(row,col) == provided.switch_player(player):
                     scores[row][col] += SCORE_OTHER
         
-def get_best_move(board,scores):
+def get_best_move(board,scores,rng=random):
     """
     Finds all of the empty squares with the maximum score 
     and randomly returns one of them as a (row,column) tuple
@@ -63,7 +72,7 @@ def get_best_move(board,scores):
             if scores[square[0]][square[1]] == scores[best_square[0]] [best_square[1]]:
                 best_square = square
             empty_max_score.append(best_square)   
-        return random.choice(empty_max_score)
+        return rng.choice(empty_max_score)
         
 
 
@@ -71,6 +80,8 @@ def mc_move(board,player,trials):
     """
     Monte carlo simulation chooses the best_move
     """
+    if USE_BITBOARD:
+        board = TTT_bitboard.from_board(board)
     scores = [[0 for dummycol in range(board.get_dim())] 
                       for dummyrow in range(board.get_dim())] 
     for _ in range(trials):
@@ -78,6 +89,488 @@ def mc_move(board,player,trials):
         mc_trial(current_board,player)
         mc_update_scores(scores,current_board,player)
     return get_best_move(board,scores)    
+
+
+def mc_batch_scores(board, player, trials, rng=random):
+    """
+    Runs all trials on bit masks: each trial plays the empty squares
+    in a random order until someone wins, and the squares played are
+    tallied per outcome.  Returns the same scores grid as running
+    mc_trial and mc_update_scores for every trial, in the standard or
+    reverse game, whichever board plays.  Hands the trials to
+    mc_numpy_scores if USE_NUMPY is set and NumPy can be imported.
+    """
+    if USE_NUMPY:
+        try:
+            # not available in CodeSkulptor
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            return mc_numpy_scores(board, player, trials, rng)
+    dim = board.get_dim()
+    reverse = TTT_bitboard.is_reverse(board)
+    cell_lines = TTT_bitboard.line_masks(dim)[1]
+    other = provided.switch_player(player)
+    start = {player: 0, other: 0}
+    empty = []
+    for row in range(dim):
+        for col in range(dim):
+            content = board.square(row, col)
+            if content == provided.EMPTY:
+                empty.append(row * dim + col)
+            else:
+                start[content] |= 1 << (row * dim + col)
+    # per square: games won minus games lost while holding it,
+    # for squares played by player and by the other player
+    current_net = [0] * (dim * dim)
+    other_net = [0] * (dim * dim)
+    order = list(empty)
+    for dummy_trial in range(trials):
+        rng.shuffle(order)
+        pieces = [start[player], start[other]]
+        turn = 0
+        winner = None
+        for idx in order:
+            mask = pieces[turn] | (1 << idx)
+            pieces[turn] = mask
+            for line in cell_lines[idx]:
+                if mask & line == line:
+                    winner = turn
+                    if reverse:
+                        winner = 1 - turn
+                    break
+            if winner is not None:
+                break
+            turn = 1 - turn
+        if winner is None:
+            continue
+        sign = 1 - 2 * winner
+        # squares already on the board count too
+        for owner in (0, 1):
+            mask = pieces[owner]
+            net = (current_net, other_net)[owner]
+            for idx in range(dim * dim):
+                if mask & (1 << idx):
+                    net[idx] += sign
+    scores = [[0 for dummycol in range(dim)] for dummyrow in range(dim)]
+    for idx in range(dim * dim):
+        scores[idx // dim][idx % dim] = (SCORE_CURRENT * current_net[idx] -
+                                         SCORE_OTHER * other_net[idx])
+    return scores
+
+def mc_numpy_scores(board, player, trials, rng=random):
+    """
+    mc_batch_scores on NumPy arrays, NUMPY_BLOCK trials at a time.
+    Each row of a random permutation matrix is the order one trial
+    plays the empty squares in.  A line is completed at the time its
+    last square is played if one player holds all of it, a trial ends
+    at the earliest completed line, and the squares held by then are
+    tallied into the scores with one matrix product per player.
+    """
+    # not available in CodeSkulptor
+    import numpy
+    dim = board.get_dim()
+    num_cells = dim * dim
+    reverse = TTT_bitboard.is_reverse(board)
+    other = provided.switch_player(player)
+    all_lines = TTT_bitboard.line_masks(dim)[0]
+    line_cells = numpy.array([[idx for idx in range(num_cells) if mask & (1 << idx)]
+                              for mask in all_lines])
+    empty = []
+    start_time = numpy.zeros(num_cells, dtype=numpy.int32)
+    start_owner = numpy.zeros(num_cells, dtype=numpy.int8)
+    for idx in range(num_cells):
+        content = board.square(idx // dim, idx % dim)
+        if content == provided.EMPTY:
+            empty.append(idx)
+        else:
+            # squares already on the board were played before time 0
+            start_time[idx] = -1
+            start_owner[idx] = int(content == other)
+    empty = numpy.array(empty, dtype=numpy.intp)
+    never = num_cells + 1
+    np_rng = numpy.random.RandomState(rng.randrange(1 << 32))
+    current_net = numpy.zeros(num_cells)
+    other_net = numpy.zeros(num_cells)
+    for block_start in range(0, trials, NUMPY_BLOCK):
+        block = min(NUMPY_BLOCK, trials - block_start)
+        order = numpy.argsort(np_rng.random_sample((block, len(empty))), axis=1)
+        play_time = numpy.tile(start_time, (block, 1))
+        owner = numpy.tile(start_owner, (block, 1))
+        rows = numpy.arange(block)[:, numpy.newaxis]
+        steps = numpy.arange(len(empty), dtype=numpy.int32)
+        play_time[rows, empty[order]] = steps
+        owner[rows, empty[order]] = steps % 2
+        # time each line is completed by a single player, or never
+        line_time = play_time[:, line_cells].max(axis=2)
+        line_owner = owner[:, line_cells]
+        single = (line_owner == line_owner[:, :, :1]).all(axis=2)
+        end_time = numpy.where(single, line_time, never).min(axis=1)
+        decided = end_time < never
+        winner = end_time % 2
+        if reverse:
+            winner = 1 - winner
+        sign = numpy.where(decided, 1 - 2 * winner, 0).astype(numpy.float64)
+        held = play_time <= end_time[:, numpy.newaxis]
+        current_net += sign.dot(held & (owner == 0))
+        other_net += sign.dot(held & (owner == 1))
+    net = SCORE_CURRENT * current_net - SCORE_OTHER * other_net
+    return [[float(net[row * dim + col]) for col in range(dim)]
+            for row in range(dim)]
+
+
+def mc_batch_move(board, player, trials):
+    """
+    Same as mc_move, with the trials run by mc_batch_scores
+    """
+    return get_best_move(board, mc_batch_scores(board, player, trials))
+
+
+def mc_chunk_scores(chunk):
+    """
+    Runs one chunk of trials in a worker process.  chunk is a tuple
+    (dim, reverse, rows of squares, player, trials, seed).
+    """
+    dim, reverse, rows, player, trials, seed = chunk
+    board = TTT_bitboard.BitboardTTTBoard(dim, reverse, rows)
+    return mc_batch_scores(board, player, trials, random.Random(seed))
+
+def mc_parallel_scores(board, player, trials, workers=None, seed=None):
+    """
+    Splits the trials into chunks of CHUNK_TRIALS, each with its own
+    seed drawn from seed, runs them on a pool of workers processes
+    and sums the scores grids.  The chunks and their seeds do not
+    depend on workers, so a fixed seed gives the same scores for any
+    number of workers.
+    """
+    dim = board.get_dim()
+    reverse = TTT_bitboard.is_reverse(board)
+    rows = [[board.square(row, col) for col in range(dim)] for row in range(dim)]
+    root = random.Random(seed)
+    chunks = []
+    for start in range(0, trials, CHUNK_TRIALS):
+        chunk_trials = min(CHUNK_TRIALS, trials - start)
+        chunks.append((dim, reverse, rows, player, chunk_trials,
+                       root.getrandbits(64)))
+    if workers == 1 or len(chunks) <= 1:
+        results = map(mc_chunk_scores, chunks)
+    else:
+        # not available in CodeSkulptor
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(mc_chunk_scores, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    scores = [[0 for dummycol in range(dim)] for dummyrow in range(dim)]
+    for chunk_scores in results:
+        for row in range(dim):
+            for col in range(dim):
+                scores[row][col] += chunk_scores[row][col]
+    return scores
+
+def mc_parallel_move(board, player, trials, workers=None, seed=None):
+    """
+    Same as mc_move, with the trials spread over worker processes
+    by mc_parallel_scores.  Ties are also broken with seed.
+    """
+    scores = mc_parallel_scores(board, player, trials, workers, seed)
+    return get_best_move(board, scores, random.Random(seed))
+
+
+
+class MCTSNode:
+    """
+    Node of the UCT search tree: a position with the player to move,
+    and the results of the trials that went through it, counted for
+    the player who moved into it (win 1, draw 0.5).
+    """
+
+    def __init__(self, masks, player, winner, full, square=None, parent=None):
+        self.masks = masks
+        self.player = player
+        self.winner = winner
+        self.square = square
+        self.parent = parent
+        self.children = {}
+        self.visits = 0
+        self.wins = 0.0
+        self.untried = []
+        if winner is None:
+            empty = full & ~(masks[0] | masks[1])
+            idx = 0
+            while empty >> idx:
+                if (empty >> idx) & 1:
+                    self.untried.append(idx)
+                idx += 1
+
+
+class MCTSPlayer:
+    """
+    Monte Carlo Tree Search (UCT) player.  Keeps its tree between moves:
+    the next search starts from the node for the position the opponent
+    left, so earlier trials are not thrown away.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._dim = None
+        self._full = None
+        self._cell_lines = None
+        self._reverse = False
+
+    def _find_root(self, masks, player):
+        """
+        Looks for the position among the nodes two plies below the
+        last root (our move, then the opponent's move).
+        """
+        if self._root is None:
+            return None
+        candidates = [self._root] + self._root.children.values()
+        for node in candidates:
+            for child in [node] + node.children.values():
+                if child.masks == masks and child.player == player:
+                    return child
+        return None
+
+    def choose_move(self, board, player, trials):
+        """
+        Runs trials UCT iterations and returns the most visited move as
+        a (row, col) tuple.  Stops early once no other move can catch
+        up with the most visited one.  Returns None if the game is over
+        or no move has been tried.
+        """
+        if board.check_win() != None:
+            return None
+        dim = board.get_dim()
+        bit_board = TTT_bitboard.from_board(board)
+        reverse = TTT_bitboard.is_reverse(bit_board)
+        if dim != self._dim or reverse != self._reverse:
+            # the tree was grown on another board size or under the
+            # other rules
+            self._root = None
+            self._dim = dim
+            self._reverse = reverse
+        self._full = (1 << (dim * dim)) - 1
+        self._cell_lines = TTT_bitboard.line_masks(dim)[1]
+        x_mask, o_mask = bit_board.get_masks()
+        masks = (x_mask, o_mask)
+        root = self._find_root(masks, player)
+        if root is None:
+            root = MCTSNode(masks, player, None, self._full)
+        root.parent = None
+        for trial in range(trials):
+            self._iterate(root)
+            if (trial + 1) % UCT_CHECK_EVERY == 0 and self._settled(root, trials - trial - 1):
+                break
+        best = None
+        for child in root.children.values():
+            if best is None or child.visits > best.visits:
+                best = child
+        self._root = best
+        if best is None:
+            return None
+        return (best.square // dim, best.square % dim)
+
+    def _settled(self, root, remaining):
+        """
+        Checks whether the most visited move stays ahead whatever
+        the remaining trials do.
+        """
+        if root.untried:
+            return False
+        visits = sorted([child.visits for child in root.children.values()])
+        return len(visits) < 2 or visits[-1] - visits[-2] > remaining
+
+    def _child(self, node, idx):
+        """
+        Adds the child of node reached by playing square idx.
+        """
+        masks = list(node.masks)
+        turn = node.player == provided.PLAYERO
+        masks[turn] |= 1 << idx
+        winner = None
+        for line in self._cell_lines[idx]:
+            if masks[turn] & line == line:
+                winner = node.player
+                if self._reverse:
+                    winner = provided.switch_player(winner)
+                break
+        if winner is None and masks[0] | masks[1] == self._full:
+            winner = provided.DRAW
+        child = MCTSNode(tuple(masks), provided.switch_player(node.player),
+                         winner, self._full, idx, node)
+        node.children[idx] = child
+        return child
+
+    def _iterate(self, root):
+        """
+        One UCT iteration: select, expand, play out, back up.
+        """
+        node = root
+        while not node.untried and node.children:
+            log_visits = math.log(node.visits)
+            best_value = None
+            for child in node.children.values():
+                value = (child.wins / child.visits +
+                         UCT_EXPLORE * math.sqrt(log_visits / child.visits))
+                if best_value is None or value > best_value:
+                    best_value = value
+                    best_child = child
+            node = best_child
+        if node.untried:
+            idx = node.untried.pop(random.randrange(len(node.untried)))
+            node = self._child(node, idx)
+        winner = node.winner
+        if winner is None:
+            winner = self._playout(node)
+        while node is not None:
+            node.visits += 1
+            if winner == provided.DRAW:
+                node.wins += 0.5
+            elif winner != node.player:
+                node.wins += 1.0
+            node = node.parent
+
+    def _playout(self, node):
+        """
+        Plays random moves from node to the end, returns the winner.
+        """
+        masks = list(node.masks)
+        empty = list(node.untried) + node.children.keys()
+        random.shuffle(empty)
+        turn = node.player == provided.PLAYERO
+        for idx in empty:
+            mask = masks[turn] | (1 << idx)
+            masks[turn] = mask
+            for line in self._cell_lines[idx]:
+                if mask & line == line:
+                    if turn != self._reverse:
+                        return provided.PLAYERO
+                    return provided.PLAYERX
+            turn = not turn
+        return provided.DRAW
+
+
+MCTS_PLAYER = MCTSPlayer()
+
+def mcts_move(board, player, trials):
+    """
+    UCT tree search version of mc_move
+    """
+    return MCTS_PLAYER.choose_move(board, player, trials)
+
+
+# Large boards: k in a row on a dim x dim board.  Every segment of k
+# squares in a row, column or diagonal has a counter per player, so a
+# move only touches the counters of the segments through its square.
+
+# (dim, k) -> segments through each square, number of segments
+_SEGMENTS = {}
+
+def segments(dim, k):
+    """
+    Returns, for each square index, the list of indices of the
+    k-square segments that contain it, and the number of segments.
+    """
+    if (dim, k) not in _SEGMENTS:
+        cell_segments = [[] for dummy_idx in range(dim * dim)]
+        num_segments = 0
+        for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            for row in range(dim):
+                for col in range(dim):
+                    end_row = row + d_row * (k - 1)
+                    end_col = col + d_col * (k - 1)
+                    if 0 <= end_row < dim and 0 <= end_col < dim:
+                        for step in range(k):
+                            idx = (row + d_row * step) * dim + col + d_col * step
+                            cell_segments[idx].append(num_segments)
+                        num_segments += 1
+        _SEGMENTS[(dim, k)] = (cell_segments, num_segments)
+    return _SEGMENTS[(dim, k)]
+
+def mc_large_scores(board, player, trials, k=None):
+    """
+    Monte Carlo scores for k in a row (default: the full board width)
+    on large boards.  Each trial plays a shuffled copy of the empty
+    squares and keeps per-segment counters, so winning is checked in
+    constant time per move.  Scoring follows mc_update_scores, in the
+    standard or reverse game, whichever board plays.
+    """
+    dim = board.get_dim()
+    if k is None:
+        k = dim
+    reverse = TTT_bitboard.is_reverse(board)
+    cell_segments, num_segments = segments(dim, k)
+    other = provided.switch_player(player)
+    # counters for player are at 2 * segment, for other at 2 * segment + 1
+    start_counts = [0] * (2 * num_segments)
+    start_squares = ([], [])
+    empty = []
+    for row in range(dim):
+        for col in range(dim):
+            idx = row * dim + col
+            content = board.square(row, col)
+            if content == provided.EMPTY:
+                empty.append(idx)
+            else:
+                turn = int(content == other)
+                start_squares[turn].append(idx)
+                for segment in cell_segments[idx]:
+                    start_counts[2 * segment + turn] += 1
+    current_net = [0] * (dim * dim)
+    other_net = [0] * (dim * dim)
+    for dummy_trial in range(trials):
+        random.shuffle(empty)
+        counts = list(start_counts)
+        turn = 0
+        winner = None
+        for position in range(len(empty)):
+            idx = empty[position]
+            for segment in cell_segments[idx]:
+                counter = 2 * segment + turn
+                counts[counter] += 1
+                if counts[counter] == k:
+                    winner = turn
+                    if reverse:
+                        winner = 1 - turn
+            if winner is not None:
+                break
+            turn = 1 - turn
+        if winner is None:
+            continue
+        sign = 1 - 2 * winner
+        for owner in (0, 1):
+            net = (current_net, other_net)[owner]
+            for idx in start_squares[owner]:
+                net[idx] += sign
+            # the squares played in this trial alternate, player first
+            for played in range(owner, position + 1, 2):
+                net[empty[played]] += sign
+    scores = [[0 for dummycol in range(dim)] for dummyrow in range(dim)]
+    for idx in range(dim * dim):
+        scores[idx // dim][idx % dim] = (SCORE_CURRENT * current_net[idx] -
+                                         SCORE_OTHER * other_net[idx])
+    return scores
+
+def mc_large_move(board, player, trials, k=None):
+    """
+    Same as mc_move for k in a row on large boards
+    """
+    return get_best_move(board, mc_large_scores(board, player, trials, k))
+
+def run_large_benchmark(dims=(3, 5, 9, 13, 19), k=5, trials=200):
+    """
+    Prints Monte Carlo trials per second on empty boards of growing size
+    """
+    for dim in dims:
+        board = TTT_bitboard.BitboardTTTBoard(dim)
+        start = time.time()
+        mc_large_scores(board, provided.PLAYERX, trials, min(k, dim))
+        elapsed = max(time.time() - start, 1e-9)
+        print "Board", dim, "x", dim, "k =", min(k, dim), ":", int(trials / elapsed), "trials/second"
                 
 
 # test for mc_trial function            
@@ -101,6 +594,8 @@ def mc_move(board,player,trials):
 #              [[3, 2, 5], [8, 2, 8], [4, 0, 2]])
                        
         
+#run_large_benchmark()
+
 # Test game with the console or the GUI. 
 
 #provided.play_game(mc_move, NTRIALS, False)        
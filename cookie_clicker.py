@@ -4,6 +4,8 @@ Cookie Clicker Simulator
 
 import simpleplot
 import math
+import random
+import time
 
 # Used to increase the timeout, if necessary
 import codeskulptor
@@ -15,6 +17,46 @@ import poc_clicker_provided as provided
 SIM_TIME = 10000000000.0
 #SIM_TIME = 10000.0
 
+class HistoryView:
+    """
+    Read-only view of a ClickerState history.  Costs nothing to build:
+    it reads the state's history columns directly, so it always shows
+    the current history.  Entries are (time, item, cost of item,
+    total cookies) tuples, as in get_history().
+    """
+
+    def __init__(self, columns, item_names):
+        self._columns = columns
+        self._item_names = item_names
+
+    def __len__(self):
+        return len(self._columns[0])
+
+    def _entry(self, index):
+        """
+        Builds the tuple for one history entry.
+        """
+        times, item_ids, costs, totals = self._columns
+        item_id = item_ids[index]
+        item = None
+        if item_id >= 0:
+            item = self._item_names[item_id]
+        return (times[index], item, costs[index], totals[index])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._entry(idx) for idx in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return self._entry(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._entry(index)
+
+
 class ClickerState:
     """
     Class to keep track of the game state.
@@ -25,7 +67,16 @@ class ClickerState:
         self._current_cookies = 0.0
         self._current_time = 0.0
         self._current_cps = 1.0
-        self._history = [(0.0,None,0.0,0.0)]
+        # history columns: time, item id (-1 for None), cost, total cookies
+        self._history_times = [0.0]
+        self._history_items = [-1]
+        self._history_costs = [0.0]
+        self._history_totals = [0.0]
+        self._item_names = []
+        self._item_ids = {}
+        self._history_view = HistoryView((self._history_times, self._history_items,
+                                          self._history_costs, self._history_totals),
+                                         self._item_names)
         
     def __str__(self):
         """
@@ -45,6 +96,14 @@ class ClickerState:
         """
         return self._current_cookies
     
+    def get_total_cookies(self):
+        """
+        Returns total number of cookies produced so far
+
+        Should return a float
+        """
+        return self._total_cookies
+
     def get_cps(self):
         """
         Gets current CPS
@@ -73,7 +132,26 @@ class ClickerState:
         Should return a copy of any internal data structures,
         so that they will not be modified outside of the class.
         """
-        return list(self._history)
+        return list(self._history_view)
+
+    def get_history_view(self):
+        """
+        Returns a read-only HistoryView of the history, without copying
+        """
+        return self._history_view
+
+    def get_history_size(self):
+        """
+        Returns the number of history entries
+        """
+        return len(self._history_times)
+
+    def history_points(self):
+        """
+        Generates (time, total cookies) pairs of the history, for plotting
+        """
+        for index in range(len(self._history_times)):
+            yield (self._history_times[index], self._history_totals[index])
 
     def time_until(self, cookies):
         """
@@ -107,15 +185,400 @@ class ClickerState:
         if self._current_cookies >= cost:
             self._current_cookies -= cost
             self._current_cps += additional_cps
-            self._history.append((self._current_time, item_name, cost,self._total_cookies))
-        
+            if item_name not in self._item_ids:
+                self._item_ids[item_name] = len(self._item_names)
+                self._item_names.append(item_name)
+            self._history_times.append(self._current_time)
+            self._history_items.append(self._item_ids[item_name])
+            self._history_costs.append(cost)
+            self._history_totals.append(self._total_cookies)
+
+    def buy_items(self, item_name, costs, additional_cps):
+        """
+        Buys one item for each cost in costs, in order, and updates
+        state as the same number of buy_item calls would
+
+        Stops at the first item you cannot afford
+        """
+        if item_name not in self._item_ids:
+            self._item_ids[item_name] = len(self._item_names)
+            self._item_names.append(item_name)
+        item_id = self._item_ids[item_name]
+        for cost in costs:
+            if self._current_cookies < cost:
+                break
+            self._current_cookies -= cost
+            self._current_cps += additional_cps
+            self._history_times.append(self._current_time)
+            self._history_items.append(item_id)
+            self._history_costs.append(cost)
+            self._history_totals.append(self._total_cookies)
+
+
+class CostTable:
+    """
+    BuildInfo replacement for the fast simulator and the purchase
+    planner.  The successive costs of each item are computed once, by
+    calling update_item on a private clone of the build info, so they
+    match BuildInfo exactly; buying only advances a per-item purchase
+    count.
+    """
+
+    def __init__(self, build_info):
+        self._info = build_info.clone()
+        self._items = list(build_info.build_items())
+        self._cps = {}
+        self._costs = {}
+        self._counts = {}
+        self._current = {}
+        for item in self._items:
+            self._cps[item] = build_info.get_cps(item)
+            self._costs[item] = [build_info.get_cost(item)]
+            self._counts[item] = 0
+            self._current[item] = build_info.get_cost(item)
+
+    def build_items(self):
+        """
+        Get a list of buildable items
+        """
+        return list(self._items)
+
+    def get_cost(self, item):
+        """
+        Get the current cost of an item
+        """
+        return self._current[item]
+
+    def get_cps(self, item):
+        """
+        Get the current CPS of an item
+        """
+        return self._cps[item]
+
+    def cost_at(self, item, count):
+        """
+        Cost of item after count more purchases than when the
+        table was built
+        """
+        costs = self._costs[item]
+        while len(costs) <= count:
+            self._info.update_item(item)
+            costs.append(self._info.get_cost(item))
+        return costs[count]
+
+    def update_item(self, item):
+        """
+        Records one purchase of item
+        """
+        self._counts[item] += 1
+        self._current[item] = self.cost_at(item, self._counts[item])
+
+    def buy_affordable(self, item, cookies):
+        """
+        Records as many consecutive purchases of item as cookies
+        pay for.  Returns the list of their costs.
+        """
+        count = self._counts[item]
+        bought = []
+        cost = self.cost_at(item, count)
+        while cookies >= cost:
+            bought.append(cost)
+            cookies -= cost
+            count += 1
+            cost = self.cost_at(item, count)
+        self._counts[item] = count
+        self._current[item] = cost
+        return bought
+
+    def clone(self):
+        """
+        Return a clone of this table
+        """
+        new_table = CostTable(self._info)
+        new_table._items = list(self._items)
+        new_table._cps = dict(self._cps)
+        new_table._costs = dict([(item, list(costs)) for item, costs in self._costs.items()])
+        new_table._counts = dict(self._counts)
+        new_table._current = dict(self._current)
+        return new_table
+
+
+class IndexedBuildInfo:
+    """
+    BuildInfo wrapper that keeps the items in a treap ordered by
+    (cost, position in build_items), so the items costing at most
+    some amount are always a prefix of the order, found by one
+    binary search down the tree.  Every node also holds the highest
+    (cost, -position) and (CPS/cost ratio, -position) of its subtree,
+    so the best item of that prefix is read off the same path.
+    update_item moves one item in O(log n) expected time.  Ties go to
+    the item that comes first in build_items, as in the strategies'
+    own loops.
+    """
+
+    def __init__(self, build_info):
+        self._info = build_info.clone()
+        self._items = list(build_info.build_items())
+        self._slots = dict([(item, slot) for slot, item in enumerate(self._items)])
+        num_items = len(self._items)
+        rng = random.Random(num_items)
+        self._priority = [rng.random() for dummy_slot in range(num_items)]
+        self._left = [-1] * num_items
+        self._right = [-1] * num_items
+        self._key = [None] * num_items
+        self._cost = [None] * num_items
+        self._ratio = [None] * num_items
+        self._best_cost = [None] * num_items
+        self._best_ratio = [None] * num_items
+        self._root = -1
+        for slot in range(num_items):
+            self._set_node(slot)
+            self._root = self._insert(self._root, slot)
+
+    def _set_node(self, slot):
+        """
+        Makes slot a single node holding the current cost and ratio
+        of its item
+        """
+        item = self._items[slot]
+        cost = self._info.get_cost(item)
+        self._key[slot] = (cost, slot)
+        self._cost[slot] = (cost, -slot)
+        self._ratio[slot] = (self._info.get_cps(item) / cost, -slot)
+        self._left[slot] = -1
+        self._right[slot] = -1
+        self._pull(slot)
+
+    def _pull(self, node):
+        """
+        Recomputes the subtree bests of node from its children
+        """
+        best_cost = self._cost[node]
+        best_ratio = self._ratio[node]
+        for child in (self._left[node], self._right[node]):
+            if child >= 0:
+                best_cost = max(best_cost, self._best_cost[child])
+                best_ratio = max(best_ratio, self._best_ratio[child])
+        self._best_cost[node] = best_cost
+        self._best_ratio[node] = best_ratio
+
+    def _split(self, node, key):
+        """
+        Splits the subtree at node into the nodes with keys below
+        key and the others.  Returns both roots.
+        """
+        if node < 0:
+            return -1, -1
+        if self._key[node] < key:
+            rest, right = self._split(self._right[node], key)
+            self._right[node] = rest
+            self._pull(node)
+            return node, right
+        left, rest = self._split(self._left[node], key)
+        self._left[node] = rest
+        self._pull(node)
+        return left, node
+
+    def _merge(self, left, right):
+        """
+        Joins two subtrees, all keys of left below all keys of right.
+        Returns the new root.
+        """
+        if left < 0:
+            return right
+        if right < 0:
+            return left
+        if self._priority[left] > self._priority[right]:
+            self._right[left] = self._merge(self._right[left], right)
+            self._pull(left)
+            return left
+        self._left[right] = self._merge(left, self._left[right])
+        self._pull(right)
+        return right
+
+    def _insert(self, root, slot):
+        """
+        Inserts the single node slot, returns the new root
+        """
+        left, right = self._split(root, self._key[slot])
+        return self._merge(self._merge(left, slot), right)
+
+    def build_items(self):
+        """
+        Get a list of buildable items
+        """
+        return list(self._items)
+
+    def get_cost(self, item):
+        """
+        Get the current cost of an item
+        """
+        return self._info.get_cost(item)
+
+    def get_cps(self, item):
+        """
+        Get the current CPS of an item
+        """
+        return self._info.get_cps(item)
+
+    def update_item(self, item):
+        """
+        Update the cost of an item by the growth factor
+        """
+        slot = self._slots[item]
+        key = self._key[slot]
+        left, rest = self._split(self._root, key)
+        dummy_node, right = self._split(rest, key + (1,))
+        self._info.update_item(item)
+        self._set_node(slot)
+        self._root = self._insert(self._merge(left, right), slot)
+
+    def clone(self):
+        """
+        Return a clone of this IndexedBuildInfo
+        """
+        return IndexedBuildInfo(self._info)
+
+    def _best_affordable(self, cookies, values, bests):
+        """
+        Returns the item whose (value, -position) pair, from values
+        with subtree maxima in bests, is highest among the items
+        costing at most cookies, if that value is above zero;
+        otherwise None
+        """
+        best = None
+        node = self._root
+        while node >= 0:
+            if self._key[node][0] <= cookies:
+                # node and its whole left subtree are affordable
+                candidates = [values[node]]
+                if self._left[node] >= 0:
+                    candidates.append(bests[self._left[node]])
+                best = max([best] + candidates)
+                node = self._right[node]
+            else:
+                node = self._left[node]
+        if best is None or best[0] <= 0.0:
+            return None
+        return self._items[-best[1]]
+
+    def cheapest_affordable(self, cookies):
+        """
+        Returns the cheapest item costing at most cookies, or None
+        """
+        node = self._root
+        if node < 0:
+            return None
+        while self._left[node] >= 0:
+            node = self._left[node]
+        if self._key[node][0] > cookies:
+            return None
+        return self._items[node]
+
+    def most_expensive_affordable(self, cookies):
+        """
+        Returns the most expensive item costing at most cookies, or None
+        """
+        return self._best_affordable(cookies, self._cost, self._best_cost)
+
+    def best_ratio_affordable(self, cookies):
+        """
+        Returns the item with the highest CPS/cost ratio among those
+        costing at most cookies, or None
+        """
+        return self._best_affordable(cookies, self._ratio, self._best_ratio)
+
       
-def simulate_clicker(build_info, duration, strategy):
+class SimulationProfile:
+    """
+    Timers and counters filled in by simulate_clicker when one is
+    passed as its profile argument.  Times are wall-clock seconds
+    spent in each phase of the simulation loop.  A profile describes
+    one run: simulate_clicker resets it before the game starts.
+    """
+
+    PHASES = ["strategy", "time_until", "history", "wait", "purchase"]
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        """
+        Clears the profile and starts its clock
+        """
+        self.times = dict([(phase, 0.0) for phase in self.PHASES])
+        self.strategy_calls = 0
+        self.purchases = 0
+        self.history_size = 0
+        self.total_time = 0.0
+        self._start = time.time()
+        self._mark = self._start
+
+    def lap(self, phase):
+        """
+        Adds the time since the previous lap to phase
+        """
+        now = time.time()
+        self.times[phase] += now - self._mark
+        self._mark = now
+        if phase == "strategy":
+            self.strategy_calls += 1
+
+    def stop(self, state):
+        """
+        Stops the clock and records the size of the final state
+        """
+        self.history_size = state.get_history_size()
+        self.purchases = self.history_size - 1
+        self.total_time = time.time() - self._start
+
+    def report(self):
+        """
+        Returns the profile as a dictionary
+        """
+        other = self.total_time - sum(self.times.values())
+        return {"phase_times": dict(self.times),
+                "other_time": max(other, 0.0),
+                "total_time": self.total_time,
+                "strategy_calls": self.strategy_calls,
+                "purchases": self.purchases,
+                "history_size": self.history_size}
+
+    def __str__(self):
+        """
+        Returns human readable profile
+        """
+        lines = []
+        for phase in self.PHASES:
+            lines.append("%-10s %10.4f s" % (phase, self.times[phase]))
+        lines.append("%-10s %10.4f s" % ("total", self.total_time))
+        lines.append("Strategy calls: " + str(self.strategy_calls) +
+                     ". \nPurchases: " + str(self.purchases) +
+                     ". \nHistory size: " + str(self.history_size))
+        return "\n".join(lines)
+
+
+def _no_lap(dummy_phase):
+    """
+    Stands in for SimulationProfile.lap when nothing is profiled
+    """
+    pass
+
+
+def simulate_clicker(build_info, duration, strategy, profile=None):
     """
     Function to run a Cookie Clicker game for the given
     duration with the given strategy.  Returns a ClickerState
     object corresponding to the final state of the game.
+
+    If profile is a SimulationProfile, it is reset and filled in
+    with the time spent in each phase of this game.
     """
+    if profile is None:
+        lap = _no_lap
+    else:
+        profile.start()
+        lap = profile.lap
 
     info = build_info.clone()
     new_clicker = ClickerState() 
@@ -123,23 +586,264 @@ def simulate_clicker(build_info, duration, strategy):
         if new_clicker.get_time() > duration:
             break
         left_time = duration - new_clicker.get_time()    
+        history = new_clicker.get_history_view()
+        lap("history")
         strateg_item = strategy (new_clicker.get_cookies(), new_clicker.get_cps(), 
-                  new_clicker.get_history(), left_time, info)
+                  history, left_time, info)
+        lap("strategy")
         if strateg_item == None:
             break
-        time_elapse = new_clicker.time_until(info.get_cost(strateg_item))
+        item_cost = info.get_cost(strateg_item)
+        time_elapse = new_clicker.time_until(item_cost)
+        lap("time_until")
         if time_elapse > left_time:
             break
         else:
             new_clicker.wait(time_elapse)
-            while new_clicker.get_cookies() >= info.get_cost(strateg_item):
-                new_clicker.buy_item(strateg_item, info.get_cost(strateg_item),
-                             info.get_cps(strateg_item))
-                info.update_item(strateg_item)    
+            lap("wait")
+            item_cps = info.get_cps(strateg_item)
+            while new_clicker.get_cookies() >= item_cost:
+                new_clicker.buy_item(strateg_item, item_cost, item_cps)
+                info.update_item(strateg_item)
+                item_cost = info.get_cost(strateg_item)
+            lap("purchase")
     new_clicker.wait(left_time)
+    if profile is not None:
+        profile.stop(new_clicker)
     return new_clicker    
+
+
+def profile_clicker(build_info, duration, strategy):
+    """
+    Runs simulate_clicker with a fresh SimulationProfile.  Returns
+    a tuple (final ClickerState, profile report dictionary).
+    """
+    profile = SimulationProfile()
+    state = simulate_clicker(build_info, duration, strategy, profile)
+    return state, profile.report()
             
 
+def count_at_most(values, limit):
+    """
+    Returns the number of entries of the sorted list values
+    that are at most limit
+    """
+    low = 0
+    high = len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] <= limit:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def choice_rivals(info, item, rule, order):
+    """
+    Returns (costs, best) for the items other than item that rule
+    scores, sorted by cost: best[index] is the highest (score, -order)
+    among the first index + 1 of them
+    """
+    entries = []
+    for other in info.build_items():
+        if other != item:
+            score = rule(info.get_cost(other), info.get_cps(other))
+            if score is not None:
+                entries.append((info.get_cost(other), score, -order[other]))
+    entries.sort()
+    costs = []
+    best = []
+    top = None
+    for cost, score, rank in entries:
+        if top is None or (score, rank) > top:
+            top = (score, rank)
+        costs.append(cost)
+        best.append(top)
+    return costs, best
+
+
+def simulate_clicker_fast(build_info, duration, strategy):
+    """
+    Same game and result as simulate_clicker.  Strategies listed in
+    STATELESS_STRATEGIES are given a CostTable instead of a BuildInfo
+    clone, every run of purchases of the same item is applied in one
+    step, and once the strategy has picked the same item twice it is
+    only called again when its rule no longer proves that it would
+    pick that item: the other items' costs do not change while the
+    same item is bought, so one sorted pass over them (choice_rivals)
+    answers every later "is anything affordable better?" with a
+    binary search.
+    """
+    if strategy not in STATELESS_STRATEGIES:
+        return simulate_clicker(build_info, duration, strategy)
+    rule = STATELESS_STRATEGIES[strategy]
+    info = CostTable(build_info)
+    order = dict([(item, index) for index, item in enumerate(info.build_items())])
+    new_clicker = ClickerState()
+    history = new_clicker.get_history_view()
+    item = None
+    repeated = False
+    rivals = None
+    while True:
+        left_time = duration - new_clicker.get_time()
+        cookies = new_clicker.get_cookies()
+        cps = new_clicker.get_cps()
+        keep = False
+        if item is not None and rule is None:
+            keep = True
+        elif item is not None and repeated:
+            if rivals is None:
+                rivals = choice_rivals(info, item, rule, order)
+            budget = cookies + left_time * cps
+            cost = info.get_cost(item)
+            score = rule(cost, info.get_cps(item))
+            if cost <= budget and score is not None:
+                position = count_at_most(rivals[0], budget)
+                keep = position == 0 or (score, -order[item]) > rivals[1][position - 1]
+        if not keep:
+            strateg_item = strategy(cookies, cps, history, left_time, info)
+            repeated = strateg_item == item
+            if not repeated:
+                rivals = None
+            item = strateg_item
+        if item == None:
+            break
+        time_elapse = new_clicker.time_until(info.get_cost(item))
+        if time_elapse > left_time:
+            break
+        new_clicker.wait(time_elapse)
+        costs = info.buy_affordable(item, new_clicker.get_cookies())
+        new_clicker.buy_items(item, costs, info.get_cps(item))
+    new_clicker.wait(duration - new_clicker.get_time())
+    return new_clicker
+
+
+class PurchasePlanner:
+    """
+    Branch-and-bound search over sequences of up to depth purchases,
+    with the same waiting and buying rules as ClickerState, for the
+    sequence that produces the most cookies by the end of the time
+    left (buying nothing more afterwards).
+
+    Total cookies only count what is produced, so buying never lowers
+    them; a branch is cut when even getting the best CPS item for free
+    on every remaining purchase could not beat the best sequence found.
+    A branch is also cut when the same purchases were reached in the
+    same time bucket no later, with as many cookies and as much
+    produced.  The search stops after node_budget nodes and returns
+    the best sequence found so far.
+    """
+
+    def __init__(self, depth=4, node_budget=20000, time_bucket=1.0):
+        self._depth = depth
+        self._node_budget = node_budget
+        self._time_bucket = time_bucket
+        self._nodes = 0
+
+    def get_nodes(self):
+        """
+        Returns the number of nodes visited by the last plan
+        """
+        return self._nodes
+
+    def plan(self, cookies, cps, time_left, build_info):
+        """
+        Returns a tuple (cookies produced by the end of time_left,
+        list of items to buy in order)
+        """
+        table = CostTable(build_info)
+        items = table.build_items()
+        # try the best CPS/cost ratio first to find good sequences early
+        items.sort(key=lambda item: -table.get_cps(item) / table.get_cost(item))
+        self._table = table
+        self._items = items
+        self._max_cps = max([table.get_cps(item) for item in items] + [0.0])
+        self._seen = {}
+        self._nodes = 0
+        self._best = (time_left * cps, [])
+        counts = dict([(item, 0) for item in items])
+        self._search(0.0, cookies, 0.0, cps, time_left, counts, [])
+        return self._best
+
+    def _search(self, time, cookies, produced, cps, time_left, counts, bought):
+        """
+        Visits the node reached by buying bought, at time with cookies
+        in hand and produced cookies made so far
+        """
+        self._nodes += 1
+        value = produced + (time_left - time) * cps
+        if value > self._best[0]:
+            self._best = (value, list(bought))
+        remaining = self._depth - len(bought)
+        if remaining == 0 or self._nodes >= self._node_budget:
+            return
+        bound = produced + (time_left - time) * (cps + remaining * self._max_cps)
+        if bound <= self._best[0]:
+            return
+        key = (int(time / self._time_bucket),
+               tuple([counts[item] for item in self._items]))
+        previous = self._seen.get(key)
+        if (previous is not None and previous[0] <= time and
+                previous[1] >= cookies and previous[2] >= produced):
+            return
+        self._seen[key] = (time, cookies, produced)
+        for item in self._items:
+            cost = self._table.cost_at(item, counts[item])
+            wait = 0.0
+            if cookies < cost:
+                wait = math.ceil((cost - cookies) / cps)
+            if time + wait > time_left:
+                continue
+            counts[item] += 1
+            bought.append(item)
+            self._search(time + wait, cookies + wait * cps - cost,
+                         produced + wait * cps, cps + self._table.get_cps(item),
+                         time_left, counts, bought)
+            bought.pop()
+            counts[item] -= 1
+            if self._nodes >= self._node_budget:
+                return
+
+
+class PlannerStrategy:
+    """
+    Strategy for simulate_clicker that buys the first item of the
+    PurchasePlanner's best sequence.  A class rather than a closure so
+    that run_tournament can send it to worker processes, and so that
+    its repr tells strategies with different parameters apart.
+    """
+
+    def __init__(self, depth=4, node_budget=20000, time_bucket=1.0):
+        self._params = (depth, node_budget, time_bucket)
+        self._planner = PurchasePlanner(depth, node_budget, time_bucket)
+        self.__name__ = "strategy_planner(%r, %r, %r)" % self._params
+
+    def __repr__(self):
+        """
+        Returns the constructor call that builds this strategy
+        """
+        return "PlannerStrategy(%r, %r, %r)" % self._params
+
+    def __call__(self, cookies, cps, history, time_left, build_info):
+        """
+        Buy the first item of the best purchase sequence found.
+        """
+        dummy_value, sequence = self._planner.plan(cookies, cps, time_left,
+                                                   build_info)
+        if not sequence:
+            return None
+        return sequence[0]
+
+
+def planner_strategy(depth=4, node_budget=20000, time_bucket=1.0):
+    """
+    Returns a strategy for simulate_clicker that buys the first item
+    of the PurchasePlanner's best sequence
+    """
+    return PlannerStrategy(depth, node_budget, time_bucket)
+
+
 def strategy_cursor_broken(cookies, cps, history, time_left, build_info):
     """
     Always pick Cursor!
@@ -165,6 +869,8 @@ def strategy_cheap(cookies, cps, history, time_left, build_info):
     Always buy the cheapest item you can afford in the time left.
     """    
     cookies += time_left * cps   
+    if isinstance(build_info, IndexedBuildInfo):
+        return build_info.cheapest_affordable(cookies)
     cheapest_price = float('inf')
     cheapest_item = None
     for item in build_info.build_items(): 
@@ -180,6 +886,8 @@ def strategy_expensive(cookies, cps, history, time_left, build_info):
     Always buy the most expensive item you can afford in the time left.
     """    
     cookies += time_left * cps
+    if isinstance(build_info, IndexedBuildInfo):
+        return build_info.most_expensive_affordable(cookies)
     most_price = 0.0
     items  = build_info.build_items()
     most_item = None
@@ -196,6 +904,8 @@ def strategy_best(cookies, cps, history, time_left, build_info):
     The best strategy.
     """
     cookies += time_left * cps
+    if isinstance(build_info, IndexedBuildInfo):
+        return build_info.best_ratio_affordable(cookies)
     best_ratio = 0.0
     best_option = None
     items  = build_info.build_items()
@@ -209,6 +919,45 @@ def strategy_best(cookies, cps, history, time_left, build_info):
     return best_option            
         
            
+def cheap_rule(cost, cps):
+    """
+    strategy_cheap's preference for an affordable item
+    """
+    return -cost
+
+
+def expensive_rule(cost, cps):
+    """
+    strategy_expensive's preference for an affordable item,
+    None if it never picks it
+    """
+    if cost > 0.0:
+        return cost
+    return None
+
+
+def best_rule(cost, cps):
+    """
+    strategy_best's preference for an affordable item,
+    None if it never picks it
+    """
+    ratio = cps / cost
+    if ratio > 0.0:
+        return ratio
+    return None
+
+
+# Strategies that simulate_clicker_fast may run on a CostTable, mapped
+# to their rule: among the items costing at most cookies + time_left *
+# cps, they pick the first one with the highest rule(cost, cps).  None
+# for strategies that always pick the same item.
+STATELESS_STRATEGIES = {strategy_cursor_broken: None,
+                        strategy_none: None,
+                        strategy_cheap: cheap_rule,
+                        strategy_expensive: expensive_rule,
+                        strategy_best: best_rule}
+
+
 def run_strategy(strategy_name, time, strategy):
     """
     Simulation for the given time with one strategy.
@@ -217,11 +966,178 @@ def run_strategy(strategy_name, time, strategy):
     print strategy_name, ":", state
 
     # Plot total cookies over time
-    history = state.get_history()
-    print history
-    history = [(item[0], item[3]) for item in history]
+    print "History entries:", state.get_history_size()
+    history = list(state.history_points())
     simpleplot.plot_lines(strategy_name, 1000, 400, 'Time', 'Total Cookies', [history], True)
 
+
+# Tournament: every strategy against every duration and every build info
+# variant.  A variant is a name mapped to a tuple (table, growth factor)
+# where table maps items to [cost, cps], as taken by provided.BuildInfo.
+# Results are kept in a tab separated file, one line per cell, keyed by
+# a hash of the cell's inputs, so a rerun only simulates new cells.
+TOURNAMENT_COLUMNS = ["key", "strategy", "variant", "duration", "total_cookies",
+                      "cps", "purchases", "runtime"]
+
+
+def build_variant(cost_scale=1.0, cps_scale=1.0, growth=provided.BUILD_GROWTH):
+    """
+    Returns a (table, growth factor) variant of the default build info
+    with all costs and CPS values scaled
+    """
+    default = provided.BuildInfo()
+    table = {}
+    for item in default.build_items():
+        table[item] = [default.get_cost(item) * cost_scale,
+                       default.get_cps(item) * cps_scale]
+    return (table, growth)
+
+
+def code_fingerprint(code):
+    """
+    Returns a string that changes whenever the bytecode, names or
+    constants of a code object (or of the functions defined in it)
+    change
+    """
+    parts = [code.co_code, repr(code.co_names)]
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            parts.append(code_fingerprint(const))
+        else:
+            parts.append(repr(const))
+    return "\n".join(parts)
+
+
+def strategy_signature(strategy):
+    """
+    Returns a string identifying a strategy for the tournament cache:
+    its module and name and its own code, plus the values a closure
+    captured, or for a callable object its class and repr.  Functions
+    it calls are not included, so editing one of them does not
+    invalidate cached cells.
+    """
+    if hasattr(strategy, "func_code"):
+        cells = [cell.cell_contents for cell in strategy.func_closure or ()]
+        return repr((strategy.__module__, strategy.__name__,
+                     code_fingerprint(strategy.func_code), cells))
+    strategy_class = strategy.__class__
+    call = getattr(strategy_class.__call__, "im_func", None)
+    code = ""
+    if call is not None:
+        code = code_fingerprint(call.func_code)
+    return repr((strategy_class.__module__, strategy_class.__name__,
+                 code, repr(strategy)))
+
+
+def tournament_key(strategy, duration, variant):
+    """
+    Returns the hash identifying the inputs of one tournament cell
+    """
+    # not available in CodeSkulptor
+    import hashlib
+    table, growth = variant
+    inputs = repr((strategy_signature(strategy), float(duration),
+                   sorted(table.items()), growth))
+    return hashlib.md5(inputs).hexdigest()
+
+
+def can_pickle(value):
+    """
+    Returns whether value can be sent to a worker process
+    """
+    # not available in CodeSkulptor
+    import pickle
+    try:
+        pickle.dumps(value)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return False
+    return True
+
+
+def run_tournament_cell(cell):
+    """
+    Simulates one tournament cell in a worker process, cell is a
+    tuple (strategy, duration, (table, growth factor)).  Returns a
+    tuple (total cookies, final CPS, number of purchases, runtime).
+    """
+    strategy, duration, variant = cell
+    start = time.time()
+    state = simulate_clicker(provided.BuildInfo(variant[0], variant[1]),
+                             duration, strategy)
+    runtime = time.time() - start
+    return (state.get_total_cookies(), state.get_cps(),
+            state.get_history_size() - 1, runtime)
+
+
+def read_tournament(filename):
+    """
+    Reads a tournament results file into a dictionary from cell key
+    to row (list of values in TOURNAMENT_COLUMNS order)
+    """
+    rows = {}
+    try:
+        results_file = open(filename)
+    except IOError:
+        return rows
+    for line in results_file.readlines()[1:]:
+        fields = line.rstrip("\n").split("\t")
+        rows[fields[0]] = [fields[0], fields[1], fields[2], float(fields[3]),
+                           float(fields[4]), float(fields[5]), int(fields[6]),
+                           float(fields[7])]
+    results_file.close()
+    return rows
+
+
+def run_tournament(strategies, durations, variants, filename=None, workers=None):
+    """
+    Runs simulate_clicker for every strategy function, duration and
+    build info variant (a dictionary from name to (table, growth
+    factor)) on a pool of workers processes.  Cells already in the
+    results file filename are not run again.  Returns the rows of the
+    results table in TOURNAMENT_COLUMNS order and writes them to
+    filename if given.
+
+    Cells are cached by tournament_key.  Strategies that cannot be
+    pickled, such as closures and lambdas, cannot go to worker
+    processes: if there is one, every cell runs in this process.
+    """
+    known = {}
+    if filename is not None:
+        known = read_tournament(filename)
+    cells = []
+    for strategy in strategies:
+        for variant_name in sorted(variants):
+            for duration in durations:
+                key = tournament_key(strategy, duration, variants[variant_name])
+                cells.append((key, strategy, variant_name, duration))
+    todo = [cell for cell in cells if cell[0] not in known]
+    tasks = [(strategy, duration, variants[variant_name])
+             for dummy_key, strategy, variant_name, duration in todo]
+    if (workers == 1 or len(tasks) <= 1 or
+            not all([can_pickle(strategy) for strategy in strategies])):
+        results = map(run_tournament_cell, tasks)
+    else:
+        # not available in CodeSkulptor
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(run_tournament_cell, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    for cell, result in zip(todo, results):
+        key, strategy, variant_name, duration = cell
+        known[key] = [key, strategy.__name__, variant_name, float(duration)] + list(result)
+    rows = [known[cell[0]] for cell in cells]
+    if filename is not None:
+        results_file = open(filename, "w")
+        results_file.write("\t".join(TOURNAMENT_COLUMNS) + "\n")
+        for row in sorted(known.values(), key=lambda row: row[1:4]):
+            results_file.write("\t".join([repr(value) if isinstance(value, float) else str(value)
+                                          for value in row]) + "\n")
+        results_file.close()
+    return rows
+
     
 def run():
     """
@@ -62,9 +62,8 @@ class SolitaireMancala:
         Last seed must be played in the store (house zero)
         """
         if self.is_legal_move(house_num):
-            for index in range(house_num):
-                self._board[index] += 1
-                self._board[house_num] -= 1   
+            self._board[:house_num] = [seeds + 1 for seeds in self._board[:house_num]]
+            self._board[house_num] = 0
         return self._board               
 
     def choose_move(self):
@@ -87,16 +86,76 @@ class SolitaireMancala:
         when given a choice of legal moves
         Not used in GUI version, only for machine testing
         """
+        board = list(self._board)
+        # legal houses, closest to the store on top; a move only adds
+        # seeds to houses below it, so new legal houses go on top
+        legal = [house for house in range(len(board) - 1, 0, -1)
+                 if board[house] == house]
         plan = []
-        temp_game = SolitaireMancala()
-        temp_game.set_board(self._board)
-        move = temp_game.choose_move()
-        while move != 0:
-            temp_game.apply_move(move)
+        while legal:
+            move = legal.pop()
+            board[:move] = [seeds + 1 for seeds in board[:move]]
+            board[move] = 0
+            legal.extend([house for house in range(move - 1, 0, -1)
+                          if board[house] == house])
             plan.append(move)
-            move = temp_game.choose_move()      
         return plan
-       
+
+
+def _winnable_steps(max_seeds):
+    """
+    Generates the winnable configurations with 0, 1, 2, ... seeds,
+    as one board list updated in place (store not maintained)
+
+    Each board is built from the previous one by undoing a move: the
+    empty house closest to the store takes back one seed from every
+    house below it.
+    """
+    if max_seeds is not None and (max_seeds < 0 or max_seeds != int(max_seeds)):
+        raise ValueError("number of seeds must be a non-negative integer")
+    board = [0]
+    # empty houses, closest to the store on top
+    empty = []
+    num_seeds = 0
+    while True:
+        yield board
+        if num_seeds == max_seeds:
+            return
+        if empty:
+            house = empty.pop()
+        else:
+            house = len(board)
+            board.append(0)
+        board[:house] = [seeds - 1 for seeds in board[:house]]
+        board[house] = house
+        empty.extend([index for index in range(house - 1, 0, -1)
+                      if board[index] == 0])
+        num_seeds += 1
+
+
+def iter_winnable_boards(max_seeds=None):
+    """
+    Generates the winnable configurations with 0, 1, 2, ... seeds,
+    up to max_seeds seeds or forever if max_seeds is None
+
+    Raises ValueError, when the first board is requested, if
+    max_seeds is negative or not a whole number
+    """
+    for board in _winnable_steps(max_seeds):
+        yield [0] + board[1:]
+
+
+def winnable_board(num_seeds):
+    """
+    Returns the unique configuration with num_seeds seeds in the
+    houses (and an empty store) that plan_moves clears completely
+
+    Raises ValueError if num_seeds is negative or not a whole number
+    """
+    for board in _winnable_steps(num_seeds):
+        pass
+    return [0] + board[1:]
+
 
 # tests
 
@@ -6,6 +6,19 @@ Simplifications:  only allow discard and roll, only score against upper level
 # Used to increase the timeout, if necessary
 import codeskulptor
 codeskulptor.set_timeout(20)
+import math
+
+# (sorted held dice, num_die_sides, num_free_dice) -> expected value
+_EXPECTED_VALUES = {}
+# (num_die_sides, num_dice) -> result of sorted_rolls
+_SORTED_ROLLS = {}
+# (num_die_sides, num_dice) -> result of roll_columns
+_ROLL_COLUMNS = {}
+# (num_die_sides, num_dice, width) -> result of roll_arrays
+_ROLL_ARRAYS = {}
+
+# Run strategy_columnar on NumPy arrays when NumPy is installed
+USE_NUMPY = True
 
 def gen_all_sequences(outcomes, length):
     """
@@ -24,6 +37,35 @@ def gen_all_sequences(outcomes, length):
     return answer_set
 
 
+def iter_all_sequences(outcomes, length):
+    """
+    Generator version of gen_all_sequences: yields each sequence of
+    outcomes of given length once, as a tuple, without building the
+    whole set.  Repeated outcomes are only used once, as in the set
+    gen_all_sequences returns.
+    """
+    distinct = []
+    seen = set()
+    for item in outcomes:
+        if item not in seen:
+            seen.add(item)
+            distinct.append(item)
+    outcomes = distinct
+    if length > 0 and not outcomes:
+        return
+    positions = [0] * length
+    while True:
+        yield tuple([outcomes[pos] for pos in positions])
+        # advance the last position that can move, reset the ones after it
+        idx = length - 1
+        while idx >= 0 and positions[idx] == len(outcomes) - 1:
+            positions[idx] = 0
+            idx -= 1
+        if idx < 0:
+            return
+        positions[idx] += 1
+
+
 def score(hand):
     """
     Computes the maximal score for a Yahtzee hand according to the
@@ -33,11 +75,10 @@ def score(hand):
 
     Returns an integer score 
     """
-    score_list = []
+    counts = {}
     for die in hand:
-        count = hand.count(die)
-        score_list.append(die*count)
-    return max(score_list)
+        counts[die] = counts.get(die, 0) + 1
+    return max([die * count for die, count in counts.items()])
 
 
 def expected_value(held_dice, num_die_sides, num_free_dice):
@@ -51,13 +92,113 @@ def expected_value(held_dice, num_die_sides, num_free_dice):
 
     Returns a floating point expected value
     """
-    rest_rolls = gen_all_sequences(range(1,num_die_sides+1), num_free_dice)
+    key = (tuple(sorted(held_dice)), num_die_sides, num_free_dice)
+    if key in _EXPECTED_VALUES:
+        return _EXPECTED_VALUES[key]
+    held_counts = {}
+    for die in held_dice:
+        held_counts[die] = held_counts.get(die, 0) + 1
+    held_best = 0
+    for die, count in held_counts.items():
+        held_best = max(held_best, die * count)
     all_scores = 0 
-    for roll in rest_rolls:
-        all_scores += score(held_dice + roll)
-    return float(all_scores) / len(rest_rolls)    
+    for faces, weight in sorted_rolls(num_die_sides, num_free_dice):
+        best = held_best
+        for die, count in faces:
+            best = max(best, die * (count + held_counts.get(die, 0)))
+        all_scores += weight * best
+    result = float(all_scores) / num_die_sides ** num_free_dice
+    _EXPECTED_VALUES[key] = result
+    return result
+
+
+def sorted_rolls(num_die_sides, num_dice):
+    """
+    Returns a list with one (faces, weight) tuple for every roll of
+    num_dice dice regardless of order: faces lists (die, count) pairs
+    and weight is the number of ordered rolls it stands for.
+    """
+    key = (num_die_sides, num_dice)
+    if key not in _SORTED_ROLLS:
+        result = []
+        for roll in gen_sorted_hands(num_dice, num_die_sides):
+            faces = [(die, roll.count(die)) for die in sorted(set(roll))]
+            weight = math.factorial(num_dice)
+            for dummy_die, count in faces:
+                weight //= math.factorial(count)
+            result.append((faces, weight))
+        _SORTED_ROLLS[key] = result
+    return _SORTED_ROLLS[key]
     
 
+def roll_columns(num_die_sides, num_dice):
+    """
+    Column form of sorted_rolls: returns a tuple (weights, columns,
+    scores) where weights[i] is the weight of roll i, columns[die][i]
+    is the number of dice showing die in roll i and scores[i] is the
+    score of roll i on its own.
+    """
+    key = (num_die_sides, num_dice)
+    if key not in _ROLL_COLUMNS:
+        rolls = sorted_rolls(num_die_sides, num_dice)
+        weights = [weight for dummy_faces, weight in rolls]
+        columns = {}
+        for die in range(1, num_die_sides + 1):
+            columns[die] = [0] * len(rolls)
+        scores = [0] * len(rolls)
+        for idx in range(len(rolls)):
+            for die, count in rolls[idx][0]:
+                columns[die][idx] = count
+                scores[idx] = max(scores[idx], die * count)
+        _ROLL_COLUMNS[key] = (weights, columns, scores)
+    return _ROLL_COLUMNS[key]
+
+
+def face_histograms(dice, width):
+    """
+    Returns the (M, width) array of face counts of an (M, n) array
+    of dice: row i counts how many dice of row i show each face.
+    One bincount over the rows shifted apart by width.
+    """
+    # not available in CodeSkulptor
+    import numpy
+    num_rows = dice.shape[0]
+    offsets = numpy.arange(num_rows)[:, numpy.newaxis] * width
+    counts = numpy.bincount((dice + offsets).ravel(), minlength=num_rows * width)
+    return counts.reshape(num_rows, width)
+
+
+def roll_arrays(num_die_sides, num_dice, width):
+    """
+    NumPy form of sorted_rolls: returns a tuple (weights, counts)
+    where weights[i] is the weight of roll i and counts[i] its face
+    histogram over faces 0 to width - 1.
+    """
+    # not available in CodeSkulptor
+    import numpy
+    key = (num_die_sides, num_dice, width)
+    if key not in _ROLL_ARRAYS:
+        rolls = sorted_rolls(num_die_sides, num_dice)
+        weights = numpy.array([weight for dummy_faces, weight in rolls],
+                              dtype=numpy.int64)
+        dice = numpy.array(gen_sorted_hands(num_dice, num_die_sides),
+                           dtype=numpy.intp).reshape(len(rolls), num_dice)
+        _ROLL_ARRAYS[key] = (weights, face_histograms(dice, width))
+    return _ROLL_ARRAYS[key]
+
+
+def gen_sorted_hands(num_dice, num_die_sides):
+    """
+    Returns the list of all hands of num_dice dice as sorted tuples,
+    in increasing order.
+    """
+    hands = [()]
+    for dummy_idx in range(num_dice):
+        hands = [hand + (die,) for hand in hands
+                 for die in range(hand[-1] if hand else 1, num_die_sides + 1)]
+    return hands
+
+
 def gen_all_holds(hand):
     """
     Generates all possible choices of dice from hand to hold.
@@ -80,6 +221,37 @@ def gen_all_holds(hand):
     return result_set    
 
 
+def iter_all_holds(hand):
+    """
+    Generator version of gen_all_holds: yields every distinct choice
+    of dice to hold once (holds with the same dice in a different order
+    are not repeated), each as a tuple in hand order.
+    """
+    faces = []
+    limits = {}
+    for die in hand:
+        if die not in limits:
+            faces.append(die)
+            limits[die] = 0
+        limits[die] += 1
+    taken = dict([(die, 0) for die in faces])
+    while True:
+        remaining = dict(taken)
+        hold = []
+        for die in hand:
+            if remaining[die] > 0:
+                hold.append(die)
+                remaining[die] -= 1
+        yield tuple(hold)
+        idx = len(faces) - 1
+        while idx >= 0 and taken[faces[idx]] == limits[faces[idx]]:
+            taken[faces[idx]] = 0
+            idx -= 1
+        if idx < 0:
+            return
+        taken[faces[idx]] += 1
+
+
 def strategy(hand, num_die_sides):
     """
     Computes the hold that maximizes the expected value when the
@@ -92,7 +264,7 @@ def strategy(hand, num_die_sides):
     the second element is a tuple of the dice to hold
     """
     winning = [0.0,0]
-    for hold_var in gen_all_holds(hand):
+    for hold_var in iter_all_holds(hand):
         exp_val = expected_value(hold_var, num_die_sides,(len(hand) - len(hold_var)))
         if exp_val > winning[0]:
             winning[0] = exp_val
@@ -100,6 +272,245 @@ def strategy(hand, num_die_sides):
     return (winning[0], winning[1])
 
 
+def strategy_columnar(hand, num_die_sides):
+    """
+    Same result as strategy, computed column-wise: for each hold the
+    score of every roll of the free dice starts from the roll's own
+    score and is raised one held die face at a time over whole
+    columns of roll_columns.  Hands the work to strategy_numpy if
+    USE_NUMPY is set and NumPy can be imported.
+    """
+    if USE_NUMPY:
+        try:
+            # not available in CodeSkulptor
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            return strategy_numpy(hand, num_die_sides)
+    winning = [0.0,0]
+    for hold_var in iter_all_holds(hand):
+        num_free_dice = len(hand) - len(hold_var)
+        weights, columns, best = roll_columns(num_die_sides, num_free_dice)
+        for die in set(hold_var):
+            held = hold_var.count(die)
+            if die in columns:
+                best = map(max, best, [die * (held + count) for count in columns[die]])
+            else:
+                # a face the dice cannot roll can only come from the hand
+                best = map(max, best, [die * held] * len(best))
+        total = sum([weight * value for weight, value in zip(weights, best)])
+        exp_val = float(total) / num_die_sides ** num_free_dice
+        if exp_val > winning[0]:
+            winning[0] = exp_val
+            winning[1]= hold_var
+    return (winning[0], winning[1])
+
+
+def strategy_numpy(hand, num_die_sides):
+    """
+    Same result as strategy, on NumPy arrays: the holds with the same
+    number of free dice are evaluated together, by adding their face
+    histograms to those of every roll from roll_arrays, scoring the
+    (holds, rolls, faces) array in one pass and weighting the rolls
+    with one matrix product.
+    """
+    # not available in CodeSkulptor
+    import numpy
+    holds = list(iter_all_holds(hand))
+    width = max([num_die_sides] + list(hand)) + 1
+    face_values = numpy.arange(width)
+    by_free_dice = {}
+    for index in range(len(holds)):
+        num_free_dice = len(hand) - len(holds[index])
+        by_free_dice.setdefault(num_free_dice, []).append(index)
+    exp_vals = [0.0] * len(holds)
+    for num_free_dice, indices in by_free_dice.items():
+        weights, roll_counts = roll_arrays(num_die_sides, num_free_dice, width)
+        held = numpy.array([holds[index] for index in indices], dtype=numpy.intp)
+        held_counts = face_histograms(held.reshape(len(indices), len(hand) - num_free_dice),
+                                      width)
+        counts = held_counts[:, numpy.newaxis, :] + roll_counts[numpy.newaxis, :, :]
+        totals = (counts * face_values).max(axis=2).dot(weights)
+        for index, total in zip(indices, totals):
+            exp_vals[index] = float(int(total)) / num_die_sides ** num_free_dice
+    winning = [0.0,0]
+    for index in range(len(holds)):
+        if exp_vals[index] > winning[0]:
+            winning[0] = exp_vals[index]
+            winning[1]= holds[index]
+    return (winning[0], winning[1])
+
+
+def strategy_sorted(task):
+    """
+    Runs strategy in a worker process, task is (sorted hand, num_die_sides)
+    """
+    return strategy(task[0], task[1])
+
+
+def strategy_many(hands, num_die_sides, workers=None, chunk_size=16):
+    """
+    Generates strategy(hand, num_die_sides) for each of hands, in order.
+    Hands with the same dice are computed once, on their sorted form
+    (so holds come back sorted), spread over a pool of workers
+    processes that each keep their own expected value cache.
+    workers=1 computes everything in this process.
+    """
+    keys = [tuple(sorted(hand)) for hand in hands]
+    unique = []
+    seen = set()
+    for key in keys:
+        if key not in seen:
+            seen.add(key)
+            unique.append(key)
+    tasks = [(key, num_die_sides) for key in unique]
+    pool = None
+    if workers == 1:
+        results = (strategy_sorted(task) for task in tasks)
+    else:
+        # not available in CodeSkulptor
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(strategy_sorted, tasks, chunk_size)
+    try:
+        done = {}
+        position = 0
+        for key in unique:
+            done[key] = results.next()
+            while position < len(keys) and keys[position] in done:
+                yield done[keys[position]]
+                position += 1
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+# Full turn planner: the hand is rolled, then up to NUM_REROLLS times
+# the player holds some dice and rerolls the rest, and the final hand
+# is scored with score().  The policy maps (sorted hand, rerolls left)
+# to the best hold and can be saved in a compact binary file:
+# "YPOL", version, number of dice, die sides, rerolls, then for
+# rerolls left = NUM_REROLLS down to 1 and each hand of
+# gen_sorted_hands in order, one byte per hand whose bit i is set
+# when die i of the sorted hand is held.
+NUM_REROLLS = 2
+POLICY_MAGIC = "YPOL"
+POLICY_VERSION = 1
+POLICY_HEADER_SIZE = 8
+
+
+def plan_turn(num_dice, num_die_sides, num_rerolls=NUM_REROLLS):
+    """
+    Computes by dynamic programming, backwards from the last roll,
+    the expected final score of every sorted hand with 0 to
+    num_rerolls rerolls left and the hold that achieves it.
+
+    The value of a hold does not depend on the hand it is taken from,
+    so it is computed once per distinct hold, from the largest holds
+    down: holding every die is worth the hand with one reroll fewer,
+    and a smaller hold is worth the average over the faces of one
+    more rolled die of holding that die too.
+
+    Returns a tuple (values, policy) of dictionaries keyed by
+    (sorted hand, rerolls left); policy values are sorted holds.
+    """
+    hands = gen_sorted_hands(num_dice, num_die_sides)
+    # holds of each size smaller than a hand, with the holds one die larger
+    holds_by_size = [gen_sorted_hands(size, num_die_sides) for size in range(num_dice)]
+    larger_holds = {}
+    for holds in holds_by_size:
+        for hold in holds:
+            larger_holds[hold] = [tuple(sorted(hold + (die,)))
+                                  for die in range(1, num_die_sides + 1)]
+    values = {}
+    policy = {}
+    for hand in hands:
+        values[(hand, 0)] = score(hand)
+    for rerolls in range(1, num_rerolls + 1):
+        hold_values = {}
+        for hand in hands:
+            hold_values[hand] = values[(hand, rerolls - 1)]
+        for size in range(num_dice - 1, -1, -1):
+            for hold in holds_by_size[size]:
+                total = 0.0
+                for larger in larger_holds[hold]:
+                    total += hold_values[larger]
+                hold_values[hold] = total / num_die_sides
+        for hand in hands:
+            best_value = None
+            best_hold = None
+            for hold in iter_all_holds(hand):
+                exp_val = hold_values[hold]
+                if best_value is None or exp_val > best_value:
+                    best_value = exp_val
+                    best_hold = hold
+            values[(hand, rerolls)] = best_value
+            policy[(hand, rerolls)] = best_hold
+    return values, policy
+
+
+def hold_mask(hand, hold):
+    """
+    Returns the bit mask of the positions of the sorted hold in the
+    sorted hand.
+    """
+    mask = 0
+    position = 0
+    for die in hold:
+        while hand[position] != die:
+            position += 1
+        mask |= 1 << position
+        position += 1
+    return mask
+
+
+def save_policy(policy, num_dice, num_die_sides, num_rerolls, filename):
+    """
+    Writes a policy from plan_turn to filename.
+    """
+    assert num_dice <= 8, "one byte per hold fits at most 8 dice"
+    data = bytearray(POLICY_MAGIC)
+    data.extend([POLICY_VERSION, num_dice, num_die_sides, num_rerolls])
+    hands = gen_sorted_hands(num_dice, num_die_sides)
+    for rerolls in range(num_rerolls, 0, -1):
+        for hand in hands:
+            data.append(hold_mask(hand, policy[(hand, rerolls)]))
+    policy_file = open(filename, "wb")
+    policy_file.write(str(data))
+    policy_file.close()
+
+
+def load_policy(filename):
+    """
+    Reads a policy written by save_policy.  Returns a tuple
+    (num_dice, num_die_sides, num_rerolls, policy).
+    """
+    policy_file = open(filename, "rb")
+    data = bytearray(policy_file.read())
+    policy_file.close()
+    assert str(data[:4]) == POLICY_MAGIC, "not a Yahtzee policy file"
+    assert data[4] == POLICY_VERSION, "unsupported policy version " + str(data[4])
+    num_dice, num_die_sides, num_rerolls = data[5], data[6], data[7]
+    hands = gen_sorted_hands(num_dice, num_die_sides)
+    policy = {}
+    position = POLICY_HEADER_SIZE
+    for rerolls in range(num_rerolls, 0, -1):
+        for hand in hands:
+            mask = data[position]
+            policy[(hand, rerolls)] = tuple([hand[idx] for idx in range(num_dice)
+                                             if mask & (1 << idx)])
+            position += 1
+    return num_dice, num_die_sides, num_rerolls, policy
+
+
+def policy_hold(policy, hand, rerolls_left):
+    """
+    Looks up the dice to hold for hand with rerolls_left rerolls left.
+    """
+    return policy[(tuple(sorted(hand)), rerolls_left)]
+
+
 def run_example():
     """
     Computes the dice to hold and expected score for an example hand